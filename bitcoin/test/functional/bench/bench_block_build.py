@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark building blocks of segwit transactions.
+
+Builds 1000-transaction blocks the way block-building tests do: compute
+txids for the merkle root, add the witness commitment, solve, serialize
+it for a few peers and build a compact block from it.
+
+The only change measured is CTransaction.calc_sha256 serializing and
+hashing the transaction once instead of twice to fill sha256 and hash.
+Serializations and the wtxid are not cached, as tests modify
+transactions in place, so the difference for a whole block is small;
+rehashing the transactions on their own shows it more clearly.
+"""
+from codecs import encode
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework.blocktools import add_witness_commitment, create_block, create_coinbase  # noqa: E402
+from test_framework.messages import COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut, HeaderAndShortIDs, hash256, uint256_from_str  # noqa: E402
+from test_framework.script import CScript, OP_0, OP_TRUE, sha256  # noqa: E402
+
+WITNESS_PROGRAM = CScript([OP_TRUE])
+SCRIPT_PUBKEY = CScript([OP_0, sha256(WITNESS_PROGRAM)])
+
+def calc_sha256_twice(self, with_witness=False):
+    if with_witness:
+        return uint256_from_str(hash256(self.serialize_with_witness()))
+    if self.sha256 is None:
+        self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
+    self.hash = encode(hash256(self.serialize_without_witness())[::-1], 'hex_codec').decode('ascii')
+
+def build_block(height, num_tx):
+    block = create_block(0, create_coinbase(height), ntime=1500000000 + height)
+    for i in range(num_tx):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(height << 32 | i, n)) for n in range(2)]
+        tx.vout = [CTxOut(1000, SCRIPT_PUBKEY) for n in range(2)]
+        tx.wit.vtxinwit = [CTxInWitness() for n in range(2)]
+        for wit in tx.wit.vtxinwit:
+            wit.scriptWitness.stack = [WITNESS_PROGRAM]
+        tx.rehash()
+        block.vtx.append(tx)
+    add_witness_commitment(block)
+    block.solve()
+    for peer in range(3):
+        block.serialize()
+    HeaderAndShortIDs().initialize_from_block(block, use_witness=True)
+    return block
+
+def run(num_blocks=5, num_tx=1000):
+    start = time.time()
+    for height in range(1, num_blocks + 1):
+        build_block(height, num_tx)
+    return (time.time() - start) / num_blocks
+
+def rehash(txs, rounds=5):
+    start = time.time()
+    for _ in range(rounds):
+        for tx in txs:
+            tx.rehash()
+    return (time.time() - start) / rounds
+
+def compare(measure):
+    current = measure()
+    calc_sha256 = CTransaction.calc_sha256
+    CTransaction.calc_sha256 = calc_sha256_twice
+    try:
+        previous = measure()
+    finally:
+        CTransaction.calc_sha256 = calc_sha256
+    print("  %-10s %8.2f ms" % ("previous", previous * 1000))
+    print("  %-10s %8.2f ms" % ("current", current * 1000))
+
+def main():
+    print("per 1000-transaction block:")
+    compare(run)
+    print("rehashing the 1000 transactions of a block:")
+    txs = build_block(1, 1000).vtx
+    compare(lambda: rehash(txs))
+
+if __name__ == '__main__':
+    main()
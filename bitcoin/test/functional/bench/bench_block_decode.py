@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark decoding serialized blocks.
+
+Decodes a block of segwit transactions four ways: field by field from a
+file object (the path taken for files other than BytesIO), from a
+BytesIO as received messages are, in one pass from a buffer, and lazily,
+which only records where each transaction starts.
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bench_block_build import build_block  # noqa: E402
+from test_framework.messages import CBlock  # noqa: E402
+
+def time_decode(decode, raw, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.time()
+        decode(raw)
+        best = min(best, time.time() - start)
+    return best
+
+def decode_stream(raw):
+    CBlock().deserialize(io.BufferedReader(io.BytesIO(raw)))
+
+def decode_bytesio(raw):
+    CBlock().deserialize(io.BytesIO(raw))
+
+def decode_buffer(raw):
+    CBlock().deserialize_from(raw)
+
+def decode_lazy(raw):
+    CBlock().deserialize_from(raw, lazy=True)
+
+def main(num_tx=2000, rounds=5):
+    raw = build_block(1, num_tx).serialize(with_witness=True)
+    print("%i-transaction block (%i bytes):" % (num_tx, len(raw)))
+    for name, decode in (("stream", decode_stream), ("bytesio", decode_bytesio), ("buffer", decode_buffer), ("lazy", decode_lazy)):
+        print("  %-8s %8.2f ms" % (name, time_decode(decode, raw, rounds) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark P2PConnection receive throughput.
+
+Records a stream of framed `block` messages, each followed by its
+transactions as `tx` messages, and a stream of small `ping` messages
+where framing dominates. Both are replayed through
+P2PConnection.data_received in fixed size chunks, as the event loop
+would deliver them, comparing against the previous bytes-slicing framing.
+"""
+from io import BytesIO
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework.blocktools import create_block, create_coinbase, create_tx_with_script  # noqa: E402
+from test_framework.messages import msg_block, msg_ping, msg_tx, sha256  # noqa: E402
+from test_framework.mininode import MAGIC_BYTES, MESSAGEMAP, P2PConnection  # noqa: E402
+
+class CountingConnection(P2PConnection):
+    def __init__(self):
+        super().__init__()
+        self.dstaddr, self.dstport, self.network = "127.0.0.1", 0, "regtest"
+        self.recvbuf, self.recvpos = bytearray(), 0
+        self.received = 0
+
+    def _log_message(self, direction, msg):
+        pass
+
+    def on_message(self, message):
+        self.received += 1
+
+class PreviousConnection(CountingConnection):
+    """The framing P2PConnection used before: slices (and copies) recvbuf per message."""
+    def data_received(self, t):
+        if len(t) > 0:
+            self.recvbuf = bytes(self.recvbuf) + t
+            self._on_data()
+
+    def _on_data(self):
+        while True:
+            if len(self.recvbuf) < 4:
+                return
+            if self.recvbuf[:4] != MAGIC_BYTES[self.network]:
+                raise ValueError("got garbage %s" % repr(self.recvbuf))
+            if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                return
+            command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
+            msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
+            checksum = self.recvbuf[4+12+4:4+12+4+4]
+            if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                return
+            msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+            if checksum != sha256(sha256(msg))[:4]:
+                raise ValueError("got bad checksum " + repr(self.recvbuf))
+            self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+            t = MESSAGEMAP[command]()
+            t.deserialize(BytesIO(msg))
+            self._log_message("receive", t)
+            self.on_message(t)
+
+def record_blocks(num_blocks=20, txs_per_block=500):
+    conn = CountingConnection()
+    stream = bytearray()
+    tip, height = 0, 1
+    for _ in range(num_blocks):
+        coinbase = create_coinbase(height)
+        block = create_block(tip, coinbase, ntime=1500000000 + height)
+        prev = coinbase
+        for _ in range(txs_per_block):
+            prev = create_tx_with_script(prev, 0, amount=prev.vout[0].nValue - 1000)
+            block.vtx.append(prev)
+        block.hashMerkleRoot = block.calc_merkle_root()
+        block.rehash()
+        stream += conn.build_message(msg_block(block))
+        stream += b"".join(conn.build_message(msg_tx(tx)) for tx in block.vtx[1:])
+        tip, height = block.sha256, height + 1
+    return bytes(stream)
+
+def record_pings(num_pings=50000):
+    conn = CountingConnection()
+    return b"".join(conn.build_message(msg_ping(nonce)) for nonce in range(num_pings))
+
+def replay(conn, stream, chunk_size):
+    start = time.time()
+    for pos in range(0, len(stream), chunk_size):
+        conn.data_received(stream[pos:pos + chunk_size])
+    return time.time() - start
+
+def main():
+    for stream_name, stream in (("blocks", record_blocks()), ("pings", record_pings())):
+        print("%s stream of %d kB" % (stream_name, len(stream) // 1000))
+        for chunk_size in (1 << 12, 1 << 16, 1 << 18):
+            for name, cls in (("previous", PreviousConnection), ("current", CountingConnection)):
+                conn = cls()
+                elapsed = replay(conn, stream, chunk_size)
+                print("  %-8s %6d byte chunks: %8.2f ms, %6.1f MB/s (%d messages)" %
+                      (name, chunk_size, elapsed * 1000, len(stream) / elapsed / 1e6, conn.received))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark framing a block relayed to many peers.
+
+Frames the same large block once per peer, as P2PDataStore does when every
+peer asks for it, through message_cache (served from the cache after the
+first peer) against framing it from scratch with build_message each time. Also times sending a batch of transactions per peer with one
+send_messages call against one send_message call per transaction.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework.blocktools import create_block, create_coinbase  # noqa: E402
+from test_framework.messages import COutPoint, CTransaction, CTxIn, CTxOut, msg_block, msg_tx  # noqa: E402
+from test_framework.mininode import NetworkThread, P2PConnection, message_cache  # noqa: E402
+
+class NullTransport():
+    def write(self, data):
+        pass
+
+    def is_closing(self):
+        return False
+
+class Peer(P2PConnection):
+    def __init__(self):
+        super().__init__()
+        self.dstaddr, self.dstport, self.network = "127.0.0.1", 0, "regtest"
+        self._transport = NullTransport()
+
+    def _log_message(self, direction, msg):
+        pass
+
+def make_block(num_txs):
+    block = create_block(1, create_coinbase(1), 1)
+    for i in range(num_txs):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i + 1, 0), bytes(107))]
+        tx.vout = [CTxOut(1000, bytes(25)), CTxOut(1000, bytes(25))]
+        tx.rehash()
+        block.vtx.append(tx)
+    block.hashMerkleRoot = block.calc_merkle_root()
+    block.rehash()
+    return block
+
+def run_loop():
+    loop = NetworkThread.network_event_loop
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+
+def main():
+    NetworkThread.network_event_loop = asyncio.new_event_loop()
+    block = make_block(3000)
+    peers = [Peer() for _ in range(30)]
+
+    message_cache.clear()
+    start = time.time()
+    for peer in peers:
+        message_cache.frame(msg_block(block), peer.network, peer.build_message)
+    cached = time.time() - start
+    start = time.time()
+    for peer in peers:
+        peer.build_message(msg_block(block))
+    uncached = time.time() - start
+    print("block of %i transactions to %i peers: uncached %8.2f ms, cached %8.2f ms" % (len(block.vtx), len(peers), uncached * 1000, cached * 1000))
+
+    txs = block.vtx[1:]
+    start = time.time()
+    for peer in peers:
+        for tx in txs:
+            peer.send_message(msg_tx(tx))
+        run_loop()
+    single = time.time() - start
+    start = time.time()
+    for peer in peers:
+        peer.send_messages([msg_tx(tx) for tx in txs])
+        run_loop()
+    batched = time.time() - start
+    print("%i transactions to %i peers: send_message %8.2f ms, send_messages %8.2f ms" % (len(txs), len(peers), single * 1000, batched * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark decoding of RPC responses in authproxy.
+
+Compares the previous decode path (decode body to str, json.loads with
+Decimal floats, then re-dump the result for the debug log) against each
+backend in authproxy.JSON_DECODERS, on a synthetic `getblock <hash> 2`
+and `getrawmempool true` response.
+"""
+import decimal
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework.authproxy import EncodeDecimal, JSON_DECODERS  # noqa: E402
+
+def make_getblock(num_tx=2000):
+    txs = []
+    for i in range(num_tx):
+        txs.append({
+            "txid": "%064x" % i,
+            "hash": "%064x" % (i + 1),
+            "version": 2,
+            "size": 225,
+            "vsize": 144,
+            "weight": 573,
+            "locktime": 0,
+            "vin": [{"txid": "%064x" % (i * 7), "vout": 1,
+                     "scriptSig": {"asm": "", "hex": ""},
+                     "txinwitness": ["30" * 71, "02" * 33],
+                     "sequence": 4294967294}],
+            "vout": [{"value": i + (i * 12345 % 10 ** 8) / 1e8, "n": n,
+                      "scriptPubKey": {"asm": "0 " + "ab" * 20, "hex": "0014" + "ab" * 20,
+                                       "reqSigs": 1, "type": "witness_v0_keyhash",
+                                       "addresses": ["bcrt1q" + "x" * 38]}}
+                     for n in range(2)],
+            "hex": "02" * 225,
+        })
+    return {"hash": "00" * 32, "confirmations": 1, "height": 500, "tx": txs}
+
+def make_rawmempool(num_tx=5000):
+    return {"%064x" % i: {"size": 225, "fee": i / 1e8,
+                          "modifiedfee": i / 1e8, "time": 1500000000 + i,
+                          "height": 500, "descendantcount": 1, "descendantsize": 225,
+                          "descendantfees": 22500, "ancestorcount": 1, "ancestorsize": 225,
+                          "ancestorfees": 22500, "wtxid": "%064x" % (i + 1),
+                          "depends": [], "spentby": []}
+            for i in range(num_tx)}
+
+def encode_response(result):
+    return json.dumps({"result": result, "error": None, "id": 1}).encode('utf8')
+
+def previous_path(data):
+    response = json.loads(data.decode('utf8'), parse_float=decimal.Decimal)
+    json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=True)
+    return response
+
+def main():
+    bodies = {
+        "getblock 2": encode_response(make_getblock()),
+        "getrawmempool true": encode_response(make_rawmempool()),
+    }
+    paths = [("previous", previous_path)] + sorted(JSON_DECODERS.items())
+    for name, body in bodies.items():
+        expected = previous_path(body)
+        print("%s (%d kB)" % (name, len(body) // 1000))
+        for path_name, decode in paths:
+            assert decode(body) == expected
+            runs = 10
+            elapsed = min(timeit.repeat(lambda: decode(body), number=runs, repeat=3)) / runs
+            print("  %-12s %8.2f ms" % (path_name, elapsed * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark BIP 152 short IDs.
+
+Times computing the short IDs of many transaction hashes one at a time with
+calculate_shortid against calculate_shortids, which batches them (using
+NumPy when it is installed), and reconstructing a compact block of that
+many transactions with ShortIDIndex.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework import siphash  # noqa: E402
+from test_framework.messages import CBlock, COutPoint, CTransaction, CTxIn, CTxOut, HeaderAndShortIDs, ShortIDIndex, calculate_shortid, calculate_shortids  # noqa: E402
+
+def make_block(num_txs):
+    block = CBlock()
+    for i in range(num_txs):
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(i + 1, 0), b"")]
+        tx.vout = [CTxOut(1000, b"\x51")]
+        tx.rehash()
+        block.vtx.append(tx)
+    return block
+
+def best_of(f, runs=3):
+    best = None
+    for _ in range(runs):
+        start = time.time()
+        f()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    rng = random.Random(0)
+    k0, k1 = rng.getrandbits(64), rng.getrandbits(64)
+    print("short IDs (NumPy %s):" % ("available" if siphash.numpy is not None else "not installed"))
+    for num in (100, 1000, 5000):
+        hashes = [rng.getrandbits(256) for _ in range(num)]
+        scalar = best_of(lambda: [calculate_shortid(k0, k1, h) for h in hashes])
+        batched = best_of(lambda: calculate_shortids(k0, k1, hashes))
+        print("  %5i hashes: scalar %8.2f ms, batched %8.2f ms" % (num, scalar * 1000, batched * 1000))
+    print("compact block reconstruction from known transactions:")
+    for num in (1000, 5000):
+        block = make_block(num)
+        cmpct = HeaderAndShortIDs()
+        cmpct.initialize_from_block(block, nonce=1)
+        reconstruct = best_of(lambda: ShortIDIndex(cmpct, block.vtx).reconstruct())
+        print("  %5i transactions: %8.2f ms" % (num, reconstruct * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark signature hashes and transaction copies.
+
+Computes the SIGHASH_ALL signature hash of every input of a consolidation
+transaction, as signing it does, and times CTransaction(tx) copies.
+Legacy hashes are compared against the previous approach of deep-copying
+the transaction and serializing the modified copy, BIP143 hashes against
+recomputing the prevouts, sequence and outputs digests for each input.
+"""
+import copy
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework.messages import COutPoint, CTransaction, CTxIn, CTxOut, hash256  # noqa: E402
+from test_framework.script import CScript, FindAndDelete, OP_CHECKSIG, OP_CODESEPARATOR, OP_DUP, OP_EQUALVERIFY, OP_HASH160, SIGHASH_ALL, SegwitVersion1SignatureHash, SigHashCache, SignatureHash  # noqa: E402
+
+SCRIPT = CScript([OP_DUP, OP_HASH160, bytes(20), OP_EQUALVERIFY, OP_CHECKSIG])
+
+def deepcopy_signature_hash(script, txTo, inIdx, hashtype):
+    """SIGHASH_ALL only, as SignatureHash used to compute it."""
+    txtmp = CTransaction()
+    txtmp.nVersion = txTo.nVersion
+    txtmp.vin = copy.deepcopy(txTo.vin)
+    txtmp.vout = copy.deepcopy(txTo.vout)
+    txtmp.nLockTime = txTo.nLockTime
+    txtmp.wit = copy.deepcopy(txTo.wit)
+    for txin in txtmp.vin:
+        txin.scriptSig = b''
+    txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+    return (hash256(txtmp.serialize_without_witness() + struct.pack(b"<I", hashtype)), None)
+
+def segwit_signature_hash(script, txTo, inIdx, hashtype):
+    return SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, 1000)
+
+def cached_segwit_signature_hash(cache):
+    """Sign with one SigHashCache shared by all inputs, as signing helpers do."""
+    def sighash(script, txTo, inIdx, hashtype):
+        return SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, 1000, cache)
+    return sighash
+
+def consolidation(num_inputs):
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(i + 1, 0), bytes(107)) for i in range(num_inputs)]
+    tx.vout = [CTxOut(num_inputs * 1000, SCRIPT)]
+    return tx
+
+def time_sign(sighash, tx):
+    start = time.time()
+    for i in range(len(tx.vin)):
+        sighash(SCRIPT, tx, i, SIGHASH_ALL)
+    return time.time() - start
+
+def time_copy(tx, rounds=100):
+    start = time.time()
+    for _ in range(rounds):
+        CTransaction(tx)
+    return (time.time() - start) / rounds
+
+def main():
+    print("signature hashes for every input:")
+    for num_inputs in (50, 100, 200):
+        tx = consolidation(num_inputs)
+        old = time_sign(deepcopy_signature_hash, tx)
+        new = time_sign(SignatureHash, tx)
+        print("  %4i inputs: deepcopy %8.2f ms, direct %8.2f ms" % (num_inputs, old * 1000, new * 1000))
+    print("BIP143 signature hashes for every input:")
+    for num_inputs in (100, 200, 500):
+        tx = consolidation(num_inputs)
+        old = time_sign(segwit_signature_hash, tx)
+        new = time_sign(cached_segwit_signature_hash(SigHashCache(tx)), tx)
+        print("  %4i inputs: uncached %8.2f ms, cached %8.2f ms" % (num_inputs, old * 1000, new * 1000))
+    tx = consolidation(500)
+    print("CTransaction(tx) of 500 inputs: %.2f ms" % (time_copy(tx) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark signing and verifying with each key backend.
+
+Signs the signature hashes of 10k inputs one by one and as a batch, then
+verifies 1k of the signatures, with every backend in KEY_BACKENDS.
+"""
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from test_framework import key  # noqa: E402
+
+def timed(f, *args):
+    start = time.time()
+    result = f(*args)
+    return result, time.time() - start
+
+def sign_each(items):
+    return [k.sign(h) for k, h in items]
+
+def main(num_inputs=10000, num_keys=100, num_verify=1000):
+    for name in sorted(key.KEY_BACKENDS):
+        key.set_key_backend(name)
+        keys = []
+        for i in range(num_keys):
+            k = key.CECKey()
+            k.set_compressed(True)
+            k.set_secretbytes(hashlib.sha256(("key %d" % i).encode()).digest())
+            keys.append(k)
+        items = [(keys[i % num_keys], hashlib.sha256(("input %d" % i).encode()).digest()) for i in range(num_inputs)]
+        sigs, each = timed(sign_each, items)
+        _, batch = timed(key.sign_batch, items)
+        checks = [(k.get_pubkey(), h, sig) for (k, h), sig in zip(items[:num_verify], sigs)]
+        valid, verify = timed(key.verify_batch, checks)
+        assert all(valid)
+        print("%s backend, %i inputs:" % (name, num_inputs))
+        print("  %-12s %8.2f s" % ("sign", each))
+        print("  %-12s %8.2f s" % ("sign_batch", batch))
+        print("  %-12s %8.2f s (%i signatures)" % ("verify", verify, num_verify))
+
+if __name__ == '__main__':
+    main()
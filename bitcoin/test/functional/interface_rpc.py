@@ -5,7 +5,8 @@
 """Tests some generic aspects of the RPC interface."""
 
 from test_framework.test_framework import BitcoinTestFramework
-from test_framework.util import assert_equal
+from test_framework.authproxy import JSONRPCException
+from test_framework.util import assert_equal, assert_raises_rpc_error
 
 class RPCInterfaceTest(BitcoinTestFramework):
     def set_test_params(self):
@@ -38,8 +39,39 @@ class RPCInterfaceTest(BitcoinTestFramework):
         assert_equal(result_by_id[3]['error'], None)
         assert result_by_id[3]['result'] is not None
 
+    def test_batch_builder(self):
+        self.log.info("Testing batch builder with chunking...")
+
+        node = self.nodes[0]
+        node.generate(25)
+        heights = range(26)
+
+        with node.batch(max_calls=10) as b:
+            hashes = [b.getblockhash(h) for h in heights]
+            invalid = b.getblockhash(1000)
+            count = b.getblockcount()
+
+        assert_equal([h.result() for h in hashes], [node.getblockhash(h) for h in heights])
+        assert_raises_rpc_error(-8, "Block height out of range", invalid.result)
+        assert_equal(count.result(), 25)
+
+        # Chunks are bounded by payload size too, and may be sent in parallel
+        with node.batch(max_bytes=200, parallel=True) as b:
+            headers = [b.getblockheader(h.result()) for h in hashes]
+        assert_equal([h.result()['height'] for h in headers], list(heights))
+
+        # Nothing is sent if the block raises
+        try:
+            with node.batch() as b:
+                unsent = b.getblockcount()
+                raise JSONRPCException({'code': -1, 'message': 'abort'})
+        except JSONRPCException:
+            pass
+        assert not unsent.done()
+
     def run_test(self):
         self.test_batch_request()
+        self.test_batch_builder()
 
 
 if __name__ == '__main__':
@@ -11,7 +11,7 @@ from decimal import Decimal
 import random
 
 from test_framework.blocktools import create_block, create_coinbase, add_witness_commitment
-from test_framework.messages import BlockTransactions, BlockTransactionsRequest, calculate_shortid, CBlock, CBlockHeader, CInv, COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut, FromHex, HeaderAndShortIDs, msg_block, msg_blocktxn, msg_cmpctblock, msg_getblocktxn, msg_getdata, msg_getheaders, msg_headers, msg_inv, msg_sendcmpct, msg_sendheaders, msg_tx, msg_witness_block, msg_witness_blocktxn, MSG_WITNESS_FLAG, NODE_NETWORK, NODE_WITNESS, P2PHeaderAndShortIDs, PrefilledTransaction, ser_uint256, ToHex
+from test_framework.messages import BlockTransactions, BlockTransactionsRequest, calculate_shortid, CBlock, CBlockHeader, CInv, COutPoint, CTransaction, CTxIn, CTxInWitness, CTxOut, FromHex, HeaderAndShortIDs, msg_block, msg_blocktxn, msg_cmpctblock, msg_getblocktxn, msg_getdata, msg_getheaders, msg_headers, msg_inv, msg_sendcmpct, msg_sendheaders, msg_tx, msg_witness_block, msg_witness_blocktxn, MSG_WITNESS_FLAG, NODE_NETWORK, NODE_WITNESS, P2PHeaderAndShortIDs, PrefilledTransaction, ser_uint256, ShortIDIndex, ToHex
 from test_framework.mininode import mininode_lock, P2PInterface
 from test_framework.script import CScript, OP_TRUE, OP_DROP
 from test_framework.test_framework import BitcoinTestFramework
@@ -350,6 +350,8 @@ class CompactBlocksTest(BitcoinTestFramework):
         # Check that the cmpctblock message announced all the transactions.
         assert_equal(len(header_and_shortids.prefilled_txn) + len(header_and_shortids.shortids), len(block.vtx))
 
+        self.check_shortid_index(version, header_and_shortids, block)
+
         # And now check that all the shortids are as expected as well.
         # Determine the siphash keys to use.
         [k0, k1] = header_and_shortids.get_siphash_keys()
@@ -369,6 +371,20 @@ class CompactBlocksTest(BitcoinTestFramework):
                 header_and_shortids.shortids.pop(0)
             index += 1
 
+    def check_shortid_index(self, version, header_and_shortids, block):
+        # Reconstructing the block from its own transactions with a
+        # ShortIDIndex must give back the same block. Work on a copy, so
+        # the received message isn't modified.
+        cmpct = HeaderAndShortIDs()
+        cmpct.header = header_and_shortids.header
+        cmpct.nonce = header_and_shortids.nonce
+        cmpct.shortids = list(header_and_shortids.shortids)
+        cmpct.prefilled_txn = list(header_and_shortids.prefilled_txn)
+        cmpct.use_witness = version == 2
+        reconstructed, missing = ShortIDIndex(cmpct, block.vtx).reconstruct()
+        assert_equal(missing, [])
+        assert_equal([tx.sha256 for tx in reconstructed.vtx], [tx.sha256 for tx in block.vtx])
+
     # Test that bitcoind requests compact blocks when we announce new blocks
     # via header or inv, and that responding to getblocktxn causes the block
     # to be successfully reconstructed.
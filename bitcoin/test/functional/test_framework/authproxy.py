@@ -26,23 +26,35 @@ ServiceProxy class:
 
 - HTTP connections persist for the life of the AuthServiceProxy object
   (if server supports HTTP/1.1)
+- optionally draws connections from a thread-safe keep-alive pool, so
+  the same server can be called from several threads at once
 - sends protocol 'version', per JSON-RPC 1.1
 - sends proper, incrementing 'id'
 - sends Basic HTTP authentication headers
 - parses all JSON numbers that look like floats as Decimal
-- uses standard Python json lib
+- uses standard Python json lib, or simplejson if it is installed
 """
 
 import base64
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 import decimal
 import http.client
+import itertools
 import json
 import logging
 import os
+import select
 import socket
+import threading
 import time
 import urllib.parse
 
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
 HTTP_TIMEOUT = 30
 USER_AGENT = "AuthServiceProxy/0.1"
 
@@ -63,11 +75,115 @@ def EncodeDecimal(o):
         return str(o)
     raise TypeError(repr(o) + " is not JSON serializable")
 
+def decode_json_stdlib(data):
+    """Decode a UTF-8 JSON response body, parsing all non-integer numbers as Decimal."""
+    # json.loads only takes bytes as of Python 3.6
+    return json.loads(data.decode('utf-8'), parse_float=decimal.Decimal)
+
+def decode_json_simplejson(data):
+    """Like decode_json_stdlib, using simplejson's C speedups if installed."""
+    return simplejson.loads(data, use_decimal=True)
+
+JSON_DECODERS = {'json': decode_json_stdlib}
+if simplejson is not None:
+    JSON_DECODERS['simplejson'] = decode_json_simplejson
+
+# Response bodies are decoded by this function, use set_json_decoder to change it
+decode_json = JSON_DECODERS.get('simplejson', decode_json_stdlib)
+
+def set_json_decoder(name):
+    """Select the backend for decoding responses by its name in JSON_DECODERS."""
+    global decode_json
+    decode_json = JSON_DECODERS[name]
+
+class LazyJSON():
+    """Formats a value as JSON only when logged, so disabled debug logging stays cheap."""
+    __slots__ = ('value', 'ensure_ascii')
+
+    def __init__(self, value, ensure_ascii=True):
+        self.value = value
+        self.ensure_ascii = ensure_ascii
+
+    def __str__(self):
+        return json.dumps(self.value, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
+
+def new_http_connection(url, timeout):
+    """Open a (lazily connecting) HTTP connection to the server of a parsed url."""
+    port = 80 if url.port is None else url.port
+    if url.scheme == 'https':
+        return http.client.HTTPSConnection(url.hostname, port, timeout=timeout)
+    return http.client.HTTPConnection(url.hostname, port, timeout=timeout)
+
+class ConnectionPool():
+    """Thread-safe pool of keep-alive HTTP connections to one RPC server.
+
+    At most `size` requests are in flight at once; further callers block
+    until a connection is returned. Idle connections are health checked
+    before reuse and reconnect transparently if the server closed them
+    (e.g. after a node restart)."""
+
+    def __init__(self, url, timeout=HTTP_TIMEOUT, size=4):
+        self.url = urllib.parse.urlparse(url)
+        self.timeout = timeout
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def _is_stale(conn):
+        # An idle keep-alive socket should never be readable: either the
+        # server closed it or it sent something we didn't ask for.
+        if conn.sock is None:
+            return False
+        try:
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = new_http_connection(self.url, self.timeout)
+            elif self._is_stale(conn):
+                conn.close()
+            try:
+                yield conn
+            except Exception:
+                # The connection may be mid-response, don't reuse it
+                conn.close()
+                raise
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(url, timeout=HTTP_TIMEOUT, size=4):
+    """Return the shared connection pool for a server url, creating it if needed."""
+    with _pools_lock:
+        pool = _pools.get((url, timeout))
+        if pool is None:
+            pool = _pools[(url, timeout)] = ConnectionPool(url, timeout, size)
+        return pool
+
 class AuthServiceProxy():
-    __id_count = 0
+    __id_count = itertools.count(1)
 
     # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
-    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True):
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, connection=None, ensure_ascii=True, pool=None):
         self.__service_url = service_url
         self._service_name = service_name
         self.ensure_ascii = ensure_ascii  # can be toggled on the fly by tests
@@ -77,7 +193,12 @@ class AuthServiceProxy():
         authpair = user + b':' + passwd
         self.__auth_header = b'Basic ' + base64.b64encode(authpair)
         self.timeout = timeout
-        self._set_conn(connection)
+        self.__pool = pool
+        if pool is None:
+            self._set_conn(connection)
+        else:
+            self.__conn = None
+            self.timeout = pool.timeout
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -85,49 +206,54 @@ class AuthServiceProxy():
             raise AttributeError
         if self._service_name is not None:
             name = "%s.%s" % (self._service_name, name)
-        return AuthServiceProxy(self.__service_url, name, connection=self.__conn)
+        return AuthServiceProxy(self.__service_url, name, connection=self.__conn, pool=self.__pool)
 
     def _request(self, method, path, postdata):
         '''
         Do a HTTP request, with retry if we get disconnected (e.g. due to a timeout).
         This is a workaround for https://bugs.python.org/issue3566 which is fixed in Python 3.5.
         '''
-        headers = {'Host': self.__url.hostname,
-                   'User-Agent': USER_AGENT,
-                   'Authorization': self.__auth_header,
-                   'Content-type': 'application/json'}
+        if self.__pool is not None:
+            with self.__pool.connection() as conn:
+                return self._request_on(conn, method, path, postdata)
         if os.name == 'nt':
             # Windows somehow does not like to re-use connections
             # TODO: Find out why the connection would disconnect occasionally and make it reusable on Windows
             self._set_conn()
+        return self._request_on(self.__conn, method, path, postdata)
+
+    def _request_on(self, conn, method, path, postdata):
+        headers = {'Host': self.__url.hostname,
+                   'User-Agent': USER_AGENT,
+                   'Authorization': self.__auth_header,
+                   'Content-type': 'application/json'}
         try:
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.request(method, path, postdata, headers)
+            return self._get_response(conn)
         except http.client.BadStatusLine as e:
             if e.line == "''":  # if connection was closed, try again
-                self.__conn.close()
-                self.__conn.request(method, path, postdata, headers)
-                return self._get_response()
+                conn.close()
+                conn.request(method, path, postdata, headers)
+                return self._get_response(conn)
             else:
                 raise
         except (BrokenPipeError, ConnectionResetError):
             # Python 3.5+ raises BrokenPipeError instead of BadStatusLine when the connection was reset
             # ConnectionResetError happens on FreeBSD with Python 3.4
-            self.__conn.close()
-            self.__conn.request(method, path, postdata, headers)
-            return self._get_response()
+            conn.close()
+            conn.request(method, path, postdata, headers)
+            return self._get_response(conn)
 
     def get_request(self, *args, **argsn):
-        AuthServiceProxy.__id_count += 1
+        id_count = next(AuthServiceProxy.__id_count)
 
-        log.debug("-%s-> %s %s" % (AuthServiceProxy.__id_count, self._service_name,
-                                   json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        log.debug("-%s-> %s %s", id_count, self._service_name, LazyJSON(args, self.ensure_ascii))
         if args and argsn:
             raise ValueError('Cannot handle both named and positional arguments')
         return {'version': '1.1',
                 'method': self._service_name,
                 'params': args or argsn,
-                'id': AuthServiceProxy.__id_count}
+                'id': id_count}
 
     def __call__(self, *args, **argsn):
         postdata = json.dumps(self.get_request(*args, **argsn), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
@@ -140,22 +266,37 @@ class AuthServiceProxy():
         else:
             return response['result']
 
-    def batch(self, rpc_call_list):
+    def batch(self, rpc_call_list=None, **kwargs):
+        """Send a list of requests (from get_request) as one JSON-RPC batch.
+
+        Without a list, return an RPCBatch to build the batch from calls
+        instead, with kwargs passed on to it."""
+        if rpc_call_list is None:
+            return RPCBatch(self, **kwargs)
         postdata = json.dumps(list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        log.debug("--> " + postdata)
+        log.debug("--> %s", postdata)
         return self._request('POST', self.__url.path, postdata.encode('utf-8'))
 
-    def _get_response(self):
+    def _batch_encoded(self, encoded_requests):
+        """Send already JSON-encoded requests as one batch."""
+        postdata = b'[' + b','.join(encoded_requests) + b']'
+        return self._request('POST', self.__url.path, postdata)
+
+    def _max_parallel_requests(self):
+        # Without a pool all calls share one connection, so send one at a time
+        return 1 if self.__pool is None else self.__pool.size
+
+    def _get_response(self, conn):
         req_start_time = time.time()
         try:
-            http_response = self.__conn.getresponse()
+            http_response = conn.getresponse()
         except socket.timeout:
             raise JSONRPCException({
                 'code': -344,
                 'message': '%r RPC took longer than %f seconds. Consider '
                            'using larger timeout for calls that take '
                            'longer to return.' % (self._service_name,
-                                                  self.__conn.timeout)})
+                                                  conn.timeout)})
         if http_response is None:
             raise JSONRPCException({
                 'code': -342, 'message': 'missing HTTP response from server'})
@@ -165,24 +306,117 @@ class AuthServiceProxy():
             raise JSONRPCException({
                 'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (http_response.status, http_response.reason)})
 
-        responsedata = http_response.read().decode('utf8')
-        response = json.loads(responsedata, parse_float=decimal.Decimal)
+        responsedata = http_response.read()
+        response = decode_json(responsedata)
         elapsed = time.time() - req_start_time
-        if "error" in response and response["error"] is None:
-            log.debug("<-%s- [%.6f] %s" % (response["id"], elapsed, json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
-        else:
-            log.debug("<-- [%.6f] %s" % (elapsed, responsedata))
+        if log.isEnabledFor(logging.DEBUG):
+            if "error" in response and response["error"] is None:
+                log.debug("<-%s- [%.6f] %s", response["id"], elapsed, LazyJSON(response["result"], self.ensure_ascii))
+            else:
+                log.debug("<-- [%.6f] %s", elapsed, responsedata.decode('utf8'))
         return response
 
     def __truediv__(self, relative_uri):
-        return AuthServiceProxy("{}/{}".format(self.__service_url, relative_uri), self._service_name, connection=self.__conn)
+        return AuthServiceProxy("{}/{}".format(self.__service_url, relative_uri), self._service_name, connection=self.__conn, pool=self.__pool)
 
     def _set_conn(self, connection=None):
-        port = 80 if self.__url.port is None else self.__url.port
         if connection:
             self.__conn = connection
             self.timeout = connection.timeout
-        elif self.__url.scheme == 'https':
-            self.__conn = http.client.HTTPSConnection(self.__url.hostname, port, timeout=self.timeout)
         else:
-            self.__conn = http.client.HTTPConnection(self.__url.hostname, port, timeout=self.timeout)
+            self.__conn = new_http_connection(self.__url, self.timeout)
+
+class RPCBatch():
+    """Collects RPC calls and sends them as JSON-RPC batch requests.
+
+    Calls made on the batch return a Future; the batch is sent when the
+    `with` block exits (or on execute()), split into chunks of at most
+    `max_calls` calls and `max_bytes` bytes of request payload. Each
+    Future resolves to its call's result, or raises the call's
+    JSONRPCException from result(). With `parallel`, chunks are sent
+    concurrently if the proxy uses a connection pool:
+
+        with node.batch() as b:
+            hashes = [b.getblockhash(h) for h in range(200)]
+        hashes = [h.result() for h in hashes]
+    """
+
+    def __init__(self, proxy, *, max_calls=1000, max_bytes=1 << 20, parallel=False):
+        self._proxy = proxy
+        self._max_calls = max_calls
+        self._max_bytes = max_bytes
+        self._parallel = parallel
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+
+        def call(*args, **argsn):
+            return self.add(getattr(self._proxy, name).get_request(*args, **argsn))
+        return call
+
+    def add(self, request):
+        """Queue a request (from get_request) and return its Future."""
+        encoded = json.dumps(request, default=EncodeDecimal, ensure_ascii=self._proxy.ensure_ascii).encode('utf-8')
+        future = Future()
+        self._calls.append((request['id'], encoded, future))
+        return future
+
+    def _chunks(self):
+        chunk, size = [], 0
+        for call in self._calls:
+            if chunk and (len(chunk) == self._max_calls or size + len(call[1]) > self._max_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(call)
+            size += len(call[1]) + 1
+        if chunk:
+            yield chunk
+
+    def _send(self, chunk):
+        try:
+            responses = self._proxy._batch_encoded([encoded for _, encoded, _ in chunk])
+            if not isinstance(responses, list):
+                raise JSONRPCException(responses.get('error') or {
+                    'code': -342, 'message': 'non-batch response to batch request'})
+        except Exception as e:
+            for _, _, future in chunk:
+                future.set_exception(e)
+            return
+        # The server may answer in any order, match responses up by id
+        by_id = {response.get('id'): response for response in responses}
+        for id_, _, future in chunk:
+            response = by_id.get(id_)
+            if response is None:
+                future.set_exception(JSONRPCException({
+                    'code': -343, 'message': 'missing response for batched call %d' % id_}))
+            elif response.get('error') is not None:
+                future.set_exception(JSONRPCException(response['error']))
+            elif 'result' not in response:
+                future.set_exception(JSONRPCException({
+                    'code': -343, 'message': 'missing JSON-RPC result'}))
+            else:
+                future.set_result(response['result'])
+
+    def execute(self):
+        """Send all queued calls and return their Futures, in call order."""
+        futures = [future for _, _, future in self._calls]
+        chunks = list(self._chunks())
+        self._calls = []
+        workers = min(len(chunks), self._proxy._max_parallel_requests()) if self._parallel else 1
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(self._send, chunks))
+        else:
+            for chunk in chunks:
+                self._send(chunk)
+        return futures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
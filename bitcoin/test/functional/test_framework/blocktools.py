@@ -4,6 +4,9 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Utilities for manipulating blocks and transactions."""
 
+from concurrent.futures import ProcessPoolExecutor
+import os
+
 from .address import (
     key_to_p2sh_p2wpkh,
     key_to_p2wpkh,
@@ -12,6 +15,7 @@ from .address import (
 )
 from .messages import (
     CBlock,
+    CBlockHeader,
     COIN,
     COutPoint,
     CTransaction,
@@ -21,11 +25,13 @@ from .messages import (
     FromHex,
     ToHex,
     bytes_to_hex_str,
+    find_nonce,
     hash256,
     hex_str_to_bytes,
     ser_string,
     ser_uint256,
     sha256,
+    uint256_from_compact,
     uint256_from_str,
 )
 from .script import (
@@ -83,6 +89,94 @@ def add_witness_commitment(block, nonce=0):
     block.hashMerkleRoot = block.calc_merkle_root()
     block.rehash()
 
+def create_chain(hashprev, height, ntime, count, pubkey=None, solver=None):
+    """Create count blocks, each with only a coinbase, on top of block hashprev.
+
+    height and ntime are those of the first block and go up by one per
+    block. Blocks are solved by solver if given, by block.solve() otherwise."""
+    blocks = []
+    for i in range(count):
+        block = create_block(hashprev, create_coinbase(height + i, pubkey), ntime + i)
+        if solver is None:
+            block.solve()
+        else:
+            solver.solve(block)
+        hashprev = block.sha256
+        blocks.append(block)
+    return blocks
+
+def _create_chain_serialized(kwargs):
+    return [block.serialize() for block in create_chain(**kwargs)]
+
+class BlockSolver():
+    """Solves and builds blocks in a pool of worker processes.
+
+    solve() splits the nonce range of a block across the workers, which
+    only pays off above regtest difficulty: at regtest difficulty the first
+    few nonces, which are tried inline, solve the block. create_chains()
+    builds independent chains (e.g. the competing branches of a reorg) one
+    per worker. Use as a context manager, or call close() when done."""
+
+    INLINE_NONCES = 1 << 12
+
+    def __init__(self, processes=None, chunk_size=1 << 16):
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.executor = ProcessPoolExecutor(self.processes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def solve(self, block):
+        block.rehash()
+        target = uint256_from_compact(block.nBits)
+        if block.sha256 <= target:
+            return block
+        prefix = CBlockHeader.serialize(block)[:76]
+        start = block.nNonce + 1
+        stop = min(start + self.INLINE_NONCES, 1 << 32)
+        nonce = find_nonce(prefix, target, start, stop)
+        start = stop
+        while nonce is None and start < 1 << 32:
+            # One chunk per worker, the lowest solving nonce wins
+            stop = min(start + self.chunk_size * self.processes, 1 << 32)
+            futures = [self.executor.submit(find_nonce, prefix, target, chunk, min(chunk + self.chunk_size, stop))
+                       for chunk in range(start, stop, self.chunk_size)]
+            for future in futures:
+                nonce = future.result()
+                if nonce is not None:
+                    break
+            for future in futures:
+                future.cancel()
+            start = stop
+        if nonce is None:
+            raise ValueError("No nonce above %i solves the block" % block.nNonce)
+        block.nNonce = nonce
+        block.rehash()
+        return block
+
+    def create_chains(self, chains):
+        """Create several chains in parallel.
+
+        chains is a list of dicts of create_chain() arguments (other than
+        solver), returns the lists of blocks in the same order."""
+        results = []
+        for serialized in self.executor.map(_create_chain_serialized, chains):
+            blocks = []
+            for data in serialized:
+                block = CBlock()
+                block.deserialize_from(data)
+                block.rehash()
+                blocks.append(block)
+            results.append(blocks)
+        return results
+
 def serialize_script_num(value):
     r = bytearray(0)
     if value == 0:
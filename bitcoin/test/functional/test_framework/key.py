@@ -1,5 +1,9 @@
 # Copyright (c) 2011 Sam Rushing
-"""ECC secp256k1 OpenSSL wrapper.
+"""ECC secp256k1 keys, signatures and ECDH.
+
+The curve arithmetic is done by a backend from KEY_BACKENDS: coincurve's
+libsecp256k1 bindings if they are installed, otherwise a pure Python
+implementation. Use set_key_backend to change it.
 
 WARNING: This module does not mlock() secrets; your private keys may end up on
 disk in swap! Use with caution!
@@ -7,138 +11,437 @@ disk in swap! Use with caution!
 This file is modified from python-bitcoinlib.
 """
 
-import ctypes
-import ctypes.util
 import hashlib
+import hmac
+import unittest
 
-ssl = ctypes.cdll.LoadLibrary(ctypes.util.find_library ('ssl') or 'libeay32')
-
-ssl.BN_new.restype = ctypes.c_void_p
-ssl.BN_new.argtypes = []
-
-ssl.BN_bin2bn.restype = ctypes.c_void_p
-ssl.BN_bin2bn.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_void_p]
-
-ssl.BN_CTX_free.restype = None
-ssl.BN_CTX_free.argtypes = [ctypes.c_void_p]
-
-ssl.BN_CTX_new.restype = ctypes.c_void_p
-ssl.BN_CTX_new.argtypes = []
-
-ssl.ECDH_compute_key.restype = ctypes.c_int
-ssl.ECDH_compute_key.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p]
-
-ssl.ECDSA_sign.restype = ctypes.c_int
-ssl.ECDSA_sign.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
-
-ssl.ECDSA_verify.restype = ctypes.c_int
-ssl.ECDSA_verify.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
-
-ssl.EC_KEY_free.restype = None
-ssl.EC_KEY_free.argtypes = [ctypes.c_void_p]
-
-ssl.EC_KEY_new_by_curve_name.restype = ctypes.c_void_p
-ssl.EC_KEY_new_by_curve_name.argtypes = [ctypes.c_int]
-
-ssl.EC_KEY_get0_group.restype = ctypes.c_void_p
-ssl.EC_KEY_get0_group.argtypes = [ctypes.c_void_p]
-
-ssl.EC_KEY_get0_public_key.restype = ctypes.c_void_p
-ssl.EC_KEY_get0_public_key.argtypes = [ctypes.c_void_p]
-
-ssl.EC_KEY_set_private_key.restype = ctypes.c_int
-ssl.EC_KEY_set_private_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
-
-ssl.EC_KEY_set_conv_form.restype = None
-ssl.EC_KEY_set_conv_form.argtypes = [ctypes.c_void_p, ctypes.c_int]
-
-ssl.EC_KEY_set_public_key.restype = ctypes.c_int
-ssl.EC_KEY_set_public_key.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
-
-ssl.i2o_ECPublicKey.restype = ctypes.c_void_p
-ssl.i2o_ECPublicKey.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
-
-ssl.EC_POINT_new.restype = ctypes.c_void_p
-ssl.EC_POINT_new.argtypes = [ctypes.c_void_p]
-
-ssl.EC_POINT_free.restype = None
-ssl.EC_POINT_free.argtypes = [ctypes.c_void_p]
-
-ssl.EC_POINT_mul.restype = ctypes.c_int
-ssl.EC_POINT_mul.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
-
-# this specifies the curve used with ECDSA.
-NID_secp256k1 = 714 # from openssl/obj_mac.h
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
 
+SECP256K1_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+SECP256K1_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+               0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
 SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
 SECP256K1_ORDER_HALF = SECP256K1_ORDER // 2
 
-# Thx to Sam Devlin for the ctypes magic 64-bit fix.
-def _check_result(val, func, args):
-    if val == 0:
-        raise ValueError
-    else:
-        return ctypes.c_void_p (val)
+try:
+    pow(2, -1, 3)
+except ValueError:
+    def modinv(a, m):
+        """Inverse of a modulo the prime m."""
+        return pow(a, m - 2, m)
+else:
+    def modinv(a, m):
+        """Inverse of a modulo the prime m."""
+        return pow(a, -1, m)
+
+def modinv_batch(values, m):
+    """Inverses of all values modulo the prime m, with a single inversion."""
+    prefix = [1]
+    for v in values:
+        prefix.append(prefix[-1] * v % m)
+    inv = modinv(prefix[-1], m)
+    r = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        r[i] = prefix[i] * inv % m
+        inv = inv * values[i] % m
+    return r
+
+def der_encode_sig(r, s):
+    """DER encode an ECDSA signature."""
+    def encode_int(v):
+        b = v.to_bytes((v.bit_length() + 8) // 8, 'big')
+        return b'\x02' + bytes([len(b)]) + b
+    body = encode_int(r) + encode_int(s)
+    return b'\x30' + bytes([len(body)]) + body
+
+def der_decode_sig(sig):
+    """Decode a strictly DER encoded ECDSA signature to (r, s), or None if it isn't one."""
+    if len(sig) < 8 or sig[0] != 0x30 or sig[1] != len(sig) - 2:
+        return None
+    values = []
+    pos = 2
+    for i in range(2):
+        if pos + 2 > len(sig) or sig[pos] != 0x02:
+            return None
+        size = sig[pos + 1]
+        b = sig[pos + 2:pos + 2 + size]
+        if size == 0 or len(b) != size or b[0] & 0x80 or (size > 1 and b[0] == 0 and not b[1] & 0x80):
+            return None
+        values.append(int.from_bytes(b, 'big'))
+        pos += 2 + size
+    if pos != len(sig):
+        return None
+    return tuple(values)
+
+# Points are affine (x, y) tuples or Jacobian (X, Y, Z) tuples, with None
+# for the point at infinity.
+
+def jacobian_double(P):
+    if P is None or P[1] == 0:
+        return None
+    p = SECP256K1_P
+    X, Y, Z = P
+    YY = Y * Y % p
+    S = 4 * X * YY % p
+    M = 3 * X * X % p
+    X3 = (M * M - 2 * S) % p
+    return (X3, (M * (S - X3) - 8 * YY * YY) % p, 2 * Y * Z % p)
+
+def jacobian_add_affine(P, Q):
+    """P + Q, for Jacobian P and affine Q."""
+    if P is None:
+        return None if Q is None else (Q[0], Q[1], 1)
+    if Q is None:
+        return P
+    p = SECP256K1_P
+    X1, Y1, Z1 = P
+    Z1Z1 = Z1 * Z1 % p
+    H = (Q[0] * Z1Z1 - X1) % p
+    r = (Q[1] * Z1 * Z1Z1 - Y1) % p
+    if H == 0:
+        return jacobian_double(P) if r == 0 else None
+    HH = H * H % p
+    HHH = H * HH % p
+    V = X1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    return (X3, (r * (V - X3) - Y1 * HHH) % p, Z1 * H % p)
+
+def jacobian_add(P, Q):
+    """P + Q, for Jacobian P and Q."""
+    if P is None:
+        return Q
+    if Q is None:
+        return P
+    p = SECP256K1_P
+    X1, Y1, Z1 = P
+    X2, Y2, Z2 = Q
+    Z1Z1 = Z1 * Z1 % p
+    Z2Z2 = Z2 * Z2 % p
+    U1 = X1 * Z2Z2 % p
+    H = (X2 * Z1Z1 - U1) % p
+    S1 = Y1 * Z2 * Z2Z2 % p
+    r = (Y2 * Z1 * Z1Z1 - S1) % p
+    if H == 0:
+        return jacobian_double(P) if r == 0 else None
+    HH = H * H % p
+    HHH = H * HH % p
+    V = U1 * HH % p
+    X3 = (r * r - HHH - 2 * V) % p
+    return (X3, (r * (V - X3) - S1 * HHH) % p, Z1 * Z2 * H % p)
+
+def to_affine_batch(points):
+    """Convert Jacobian points (none at infinity) to affine, with a single inversion."""
+    p = SECP256K1_P
+    r = []
+    for (X, Y, Z), inv in zip(points, modinv_batch([P[2] for P in points], p)):
+        inv2 = inv * inv % p
+        r.append((X * inv2 % p, Y * inv2 * inv % p))
+    return r
+
+def to_affine(P):
+    return None if P is None else to_affine_batch([P])[0]
+
+def lift_x(x, odd):
+    """The point with x coordinate x and y of the given parity, or None."""
+    p = SECP256K1_P
+    if x >= p:
+        return None
+    y2 = (pow(x, 3, p) + 7) % p
+    y = pow(y2, (p + 1) // 4, p)
+    if y * y % p != y2:
+        return None
+    return (x, p - y if (y & 1) != odd else y)
+
+def decode_pubkey(pubkey):
+    """Decode a serialized public key to an affine point, or None if it isn't valid."""
+    if len(pubkey) == 33 and pubkey[0] in (2, 3):
+        return lift_x(int.from_bytes(pubkey[1:], 'big'), pubkey[0] & 1)
+    if len(pubkey) == 65 and pubkey[0] in (4, 6, 7):
+        p = SECP256K1_P
+        x = int.from_bytes(pubkey[1:33], 'big')
+        y = int.from_bytes(pubkey[33:], 'big')
+        if x >= p or y >= p or (y * y - x * x * x - 7) % p != 0:
+            return None
+        if pubkey[0] != 4 and (y & 1) != (pubkey[0] & 1):
+            return None
+        return (x, y)
+    return None
+
+def encode_pubkey(point, compressed):
+    x, y = point
+    if compressed:
+        return bytes([2 + (y & 1)]) + x.to_bytes(32, 'big')
+    return b'\x04' + x.to_bytes(32, 'big') + y.to_bytes(32, 'big')
+
+def rfc6979_nonces(secret, hash):
+    """Deterministic ECDSA nonces for secret and hash, as in RFC 6979."""
+    h1 = (int.from_bytes(hash, 'big') % SECP256K1_ORDER).to_bytes(32, 'big')
+    V = b'\x01' * 32
+    K = b'\x00' * 32
+    K = hmac.new(K, V + b'\x00' + secret + h1, hashlib.sha256).digest()
+    V = hmac.new(K, V, hashlib.sha256).digest()
+    K = hmac.new(K, V + b'\x01' + secret + h1, hashlib.sha256).digest()
+    V = hmac.new(K, V, hashlib.sha256).digest()
+    while True:
+        V = hmac.new(K, V, hashlib.sha256).digest()
+        k = int.from_bytes(V, 'big')
+        if 1 <= k < SECP256K1_ORDER:
+            yield k
+        K = hmac.new(K, V + b'\x00', hashlib.sha256).digest()
+        V = hmac.new(K, V, hashlib.sha256).digest()
+
+
+class PythonBackend():
+    """Pure Python secp256k1.
+
+    Multiples of the generator are looked up in a table of precomputed
+    points, built on first use, so k*G costs one addition per window of
+    G_TABLE_BITS bits of k and no doublings."""
+
+    G_TABLE_BITS = 8
+
+    def __init__(self):
+        self.g_table = None
+
+    def _build_g_table(self):
+        size = (1 << self.G_TABLE_BITS) - 1
+        base = (SECP256K1_G[0], SECP256K1_G[1], 1)
+        points = []
+        for i in range((256 + self.G_TABLE_BITS - 1) // self.G_TABLE_BITS):
+            P = base
+            points.append(P)
+            for j in range(size - 1):
+                P = jacobian_add(P, base)
+                points.append(P)
+            base = jacobian_add(P, base)
+        points = to_affine_batch(points)
+        self.g_table = [points[i:i + size] for i in range(0, len(points), size)]
+
+    def mul_g(self, k):
+        """k*G as a Jacobian point."""
+        if self.g_table is None:
+            self._build_g_table()
+        bits = self.G_TABLE_BITS
+        mask = (1 << bits) - 1
+        P = None
+        for row in self.g_table:
+            j = k & mask
+            if j:
+                P = jacobian_add_affine(P, row[j - 1])
+            k >>= bits
+        return P
+
+    @staticmethod
+    def mul(k, Q):
+        """k*Q as a Jacobian point, for affine Q."""
+        multiples = [(Q[0], Q[1], 1)]
+        for i in range(14):
+            multiples.append(jacobian_add_affine(multiples[-1], Q))
+        if None in multiples:
+            # Q has a small order, which no point on secp256k1 has
+            raise ValueError("Point is not on the curve.")
+        multiples = [None] + to_affine_batch(multiples)
+        p = SECP256K1_P
+        P = None
+        for shift in range((k.bit_length() + 3) & ~3, -4, -4):
+            if P is not None:
+                # Four doublings, inlined as they take most of the time
+                X, Y, Z = P
+                for i in range(4):
+                    YY = Y * Y % p
+                    S = 4 * X * YY % p
+                    M = 3 * X * X % p
+                    Z = 2 * Y * Z % p
+                    X = (M * M - 2 * S) % p
+                    Y = (M * (S - X) - 8 * YY * YY) % p
+                P = (X, Y, Z)
+            P = jacobian_add_affine(P, multiples[(k >> shift) & 15])
+        return P
+
+    @staticmethod
+    def _secret(secret):
+        d = int.from_bytes(secret, 'big')
+        if not 1 <= d < SECP256K1_ORDER:
+            raise ValueError("Secret is not a valid secp256k1 private key.")
+        return d
+
+    def pubkey(self, secret, compressed):
+        return encode_pubkey(to_affine(self.mul_g(self._secret(secret))), compressed)
+
+    def reformat_pubkey(self, pubkey, compressed):
+        point = decode_pubkey(pubkey)
+        return None if point is None else encode_pubkey(point, compressed)
+
+    def sign(self, secret, hash, low_s=True):
+        return self.sign_batch([(secret, hash)], low_s)[0]
+
+    def sign_batch(self, items, low_s=True):
+        n = SECP256K1_ORDER
+        todo = []
+        for secret, hash in items:
+            nonces = rfc6979_nonces(secret, hash)
+            k = next(nonces)
+            todo.append((self._secret(secret), int.from_bytes(hash, 'big'), nonces, k, self.mul_g(k)))
+        sigs = [None] * len(todo)
+        remaining = list(range(len(todo)))
+        while remaining:
+            # The inversions of all nonces and all R.z are shared
+            kinvs = modinv_batch([todo[i][3] for i in remaining], n)
+            zinvs = modinv_batch([todo[i][4][2] for i in remaining], SECP256K1_P)
+            retry = []
+            for i, kinv, zinv in zip(remaining, kinvs, zinvs):
+                d, z, nonces, k, R = todo[i]
+                r = R[0] * zinv * zinv % SECP256K1_P % n
+                s = kinv * (z + r * d) % n
+                if r == 0 or s == 0:
+                    k = next(nonces)
+                    todo[i] = (d, z, nonces, k, self.mul_g(k))
+                    retry.append(i)
+                    continue
+                if low_s and s > SECP256K1_ORDER_HALF:
+                    s = n - s
+                sigs[i] = der_encode_sig(r, s)
+            remaining = retry
+        return sigs
+
+    def verify(self, pubkey, hash, sig):
+        Q = decode_pubkey(pubkey)
+        rs = der_decode_sig(sig)
+        if Q is None or rs is None:
+            return False
+        r, s = rs
+        n = SECP256K1_ORDER
+        if not (1 <= r < n and 1 <= s < n):
+            return False
+        w = modinv(s, n)
+        z = int.from_bytes(hash, 'big')
+        R = jacobian_add(self.mul_g(z * w % n), self.mul(r * w % n, Q))
+        if R is None:
+            return False
+        # Compare x(R) mod n to r without converting R to affine
+        p = SECP256K1_P
+        zz = R[2] * R[2] % p
+        return any(x * zz % p == R[0] for x in (r, r + n) if x < p)
+
+    def verify_batch(self, items):
+        return [self.verify(pubkey, hash, sig) for pubkey, hash, sig in items]
+
+    def ecdh(self, secret, pubkey):
+        Q = decode_pubkey(pubkey)
+        if Q is None:
+            raise ValueError("Invalid public key.")
+        return to_affine(self.mul(self._secret(secret), Q))[0].to_bytes(32, 'big')
+
+
+class CoincurveBackend():
+    """secp256k1 through coincurve's libsecp256k1 bindings"""
+
+    def pubkey(self, secret, compressed):
+        return coincurve.PrivateKey(secret).public_key.format(compressed)
+
+    def reformat_pubkey(self, pubkey, compressed):
+        # libsecp256k1 doesn't parse the hybrid forms
+        point = decode_pubkey(pubkey)
+        return None if point is None else encode_pubkey(point, compressed)
+
+    def sign(self, secret, hash, low_s=True):
+        sig = coincurve.PrivateKey(secret).sign(hash, hasher=None)
+        if low_s:
+            return sig
+        # libsecp256k1 only creates low S signatures. It uses the same
+        # RFC 6979 nonce as PythonBackend, so recompute the S that nonce
+        # gives, which may be high, to return the same signature.
+        r, s = der_decode_sig(sig)
+        n = SECP256K1_ORDER
+        k = next(rfc6979_nonces(secret, hash))
+        s = modinv(k, n) * (int.from_bytes(hash, 'big') + r * int.from_bytes(secret, 'big')) % n
+        return der_encode_sig(r, s)
+
+    def sign_batch(self, items, low_s=True):
+        return [self.sign(secret, hash, low_s) for secret, hash in items]
+
+    def verify(self, pubkey, hash, sig):
+        rs = der_decode_sig(sig)
+        pubkey = self.reformat_pubkey(pubkey, True)
+        if rs is None or pubkey is None:
+            return False
+        r, s = rs
+        # libsecp256k1 rejects high S signatures, which are valid ECDSA
+        if s > SECP256K1_ORDER_HALF:
+            sig = der_encode_sig(r, SECP256K1_ORDER - s)
+        try:
+            return coincurve.PublicKey(pubkey).verify(sig, hash, hasher=None)
+        except ValueError:
+            return False
+
+    def verify_batch(self, items):
+        return [self.verify(pubkey, hash, sig) for pubkey, hash, sig in items]
+
+    def ecdh(self, secret, pubkey):
+        return coincurve.PublicKey(pubkey).multiply(secret).format(True)[1:]
+
+
+KEY_BACKENDS = {'python': PythonBackend()}
+if coincurve is not None:
+    KEY_BACKENDS['coincurve'] = CoincurveBackend()
+
+# All key operations go through this backend, use set_key_backend to change it
+backend = KEY_BACKENDS.get('coincurve', KEY_BACKENDS['python'])
+
+def set_key_backend(name):
+    """Select the backend for key operations by its name in KEY_BACKENDS."""
+    global backend
+    backend = KEY_BACKENDS[name]
+
+def sign_batch(items, low_s=True):
+    """Sign many hashes at once.
+
+    items are (CECKey, hash) pairs, returns the DER signatures in order."""
+    return backend.sign_batch([(key.get_secretbytes(), hash) for key, hash in items], low_s)
+
+def verify_batch(items):
+    """Verify many signatures at once.
+
+    items are (pubkey, hash, sig) triples with serialized public keys (e.g.
+    CPubKey), returns whether each is valid."""
+    return backend.verify_batch(items)
 
-ssl.EC_KEY_new_by_curve_name.restype = ctypes.c_void_p
-ssl.EC_KEY_new_by_curve_name.errcheck = _check_result
 
 class CECKey():
-    """Wrapper around OpenSSL's EC_KEY"""
-
-    POINT_CONVERSION_COMPRESSED = 2
-    POINT_CONVERSION_UNCOMPRESSED = 4
+    """A secp256k1 key pair, or only a public key"""
 
     def __init__(self):
-        self.k = ssl.EC_KEY_new_by_curve_name(NID_secp256k1)
-
-    def __del__(self):
-        if ssl:
-            ssl.EC_KEY_free(self.k)
-        self.k = None
+        self.secret = None
+        self.pubkey = None
+        self.compressed = False
 
     def set_secretbytes(self, secret):
-        priv_key = ssl.BN_bin2bn(secret, 32, ssl.BN_new())
-        group = ssl.EC_KEY_get0_group(self.k)
-        pub_key = ssl.EC_POINT_new(group)
-        ctx = ssl.BN_CTX_new()
-        if not ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx):
-            raise ValueError("Could not derive public key from the supplied secret.")
-        ssl.EC_POINT_mul(group, pub_key, priv_key, None, None, ctx)
-        ssl.EC_KEY_set_private_key(self.k, priv_key)
-        ssl.EC_KEY_set_public_key(self.k, pub_key)
-        ssl.EC_POINT_free(pub_key)
-        ssl.BN_CTX_free(ctx)
-        return self.k
-
-    def set_privkey(self, key):
-        self.mb = ctypes.create_string_buffer(key)
-        return ssl.d2i_ECPrivateKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
+        # The secret is the first 32 bytes, tests pass shorter strings too
+        secret = bytes(secret[:32]).ljust(32, b'\x00')
+        self.pubkey = backend.pubkey(secret, self.compressed)
+        self.secret = secret
 
-    def set_pubkey(self, key):
-        self.mb = ctypes.create_string_buffer(key)
-        return ssl.o2i_ECPublicKey(ctypes.byref(self.k), ctypes.byref(ctypes.pointer(self.mb)), len(key))
+    def get_secretbytes(self):
+        if self.secret is None:
+            raise ValueError("Key has no secret")
+        return self.secret
 
-    def get_privkey(self):
-        size = ssl.i2d_ECPrivateKey(self.k, 0)
-        mb_pri = ctypes.create_string_buffer(size)
-        ssl.i2d_ECPrivateKey(self.k, ctypes.byref(ctypes.pointer(mb_pri)))
-        return mb_pri.raw
+    def set_pubkey(self, key):
+        """Set the public key from its serialization, return whether it is valid."""
+        pubkey = backend.reformat_pubkey(key, len(key) == 33)
+        self.secret = None
+        self.pubkey = pubkey
+        self.compressed = len(key) == 33
+        return pubkey is not None
 
     def get_pubkey(self):
-        size = ssl.i2o_ECPublicKey(self.k, 0)
-        mb = ctypes.create_string_buffer(size)
-        ssl.i2o_ECPublicKey(self.k, ctypes.byref(ctypes.pointer(mb)))
-        return mb.raw
+        return self.pubkey
 
     def get_raw_ecdh_key(self, other_pubkey):
-        ecdh_keybuffer = ctypes.create_string_buffer(32)
-        r = ssl.ECDH_compute_key(ctypes.pointer(ecdh_keybuffer), 32,
-                                 ssl.EC_KEY_get0_public_key(other_pubkey.k),
-                                 self.k, 0)
-        if r != 32:
-            raise Exception('CKey.get_ecdh_key(): ECDH_compute_key() failed')
-        return ecdh_keybuffer.raw
+        return backend.ecdh(self.get_secretbytes(), other_pubkey.get_pubkey())
 
     def get_ecdh_key(self, other_pubkey, kdf=lambda k: hashlib.sha256(k).digest()):
         # FIXME: be warned it's not clear what the kdf should be as a default
@@ -146,47 +449,20 @@ class CECKey():
         return kdf(r)
 
     def sign(self, hash, low_s = True):
-        # FIXME: need unit tests for below cases
         if not isinstance(hash, bytes):
             raise TypeError('Hash must be bytes instance; got %r' % hash.__class__)
         if len(hash) != 32:
             raise ValueError('Hash must be exactly 32 bytes long')
-
-        sig_size0 = ctypes.c_uint32()
-        sig_size0.value = ssl.ECDSA_size(self.k)
-        mb_sig = ctypes.create_string_buffer(sig_size0.value)
-        result = ssl.ECDSA_sign(0, hash, len(hash), mb_sig, ctypes.byref(sig_size0), self.k)
-        assert 1 == result
-        assert mb_sig.raw[0] == 0x30
-        assert mb_sig.raw[1] == sig_size0.value - 2
-        total_size = mb_sig.raw[1]
-        assert mb_sig.raw[2] == 2
-        r_size = mb_sig.raw[3]
-        assert mb_sig.raw[4 + r_size] == 2
-        s_size = mb_sig.raw[5 + r_size]
-        s_value = int.from_bytes(mb_sig.raw[6+r_size:6+r_size+s_size], byteorder='big')
-        if (not low_s) or s_value <= SECP256K1_ORDER_HALF:
-            return mb_sig.raw[:sig_size0.value]
-        else:
-            low_s_value = SECP256K1_ORDER - s_value
-            low_s_bytes = (low_s_value).to_bytes(33, byteorder='big')
-            while len(low_s_bytes) > 1 and low_s_bytes[0] == 0 and low_s_bytes[1] < 0x80:
-                low_s_bytes = low_s_bytes[1:]
-            new_s_size = len(low_s_bytes)
-            new_total_size_byte = (total_size + new_s_size - s_size).to_bytes(1,byteorder='big')
-            new_s_size_byte = (new_s_size).to_bytes(1,byteorder='big')
-            return b'\x30' + new_total_size_byte + mb_sig.raw[2:5+r_size] + new_s_size_byte + low_s_bytes
+        return backend.sign(self.get_secretbytes(), hash, low_s)
 
     def verify(self, hash, sig):
         """Verify a DER signature"""
-        return ssl.ECDSA_verify(0, hash, len(hash), sig, len(sig), self.k) == 1
+        return self.pubkey is not None and backend.verify(self.pubkey, hash, sig)
 
     def set_compressed(self, compressed):
-        if compressed:
-            form = self.POINT_CONVERSION_COMPRESSED
-        else:
-            form = self.POINT_CONVERSION_UNCOMPRESSED
-        ssl.EC_KEY_set_conv_form(self.k, form)
+        self.compressed = compressed
+        if self.pubkey is not None:
+            self.pubkey = backend.reformat_pubkey(self.pubkey, compressed)
 
 
 class CPubKey(bytes):
@@ -224,3 +500,41 @@ class CPubKey(bytes):
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, super(CPubKey, self).__repr__())
 
+
+class TestFrameworkKey(unittest.TestCase):
+    def samples(self):
+        for i in range(16):
+            yield hashlib.sha256(("secret %d" % i).encode()).digest(), hashlib.sha256(("hash %d" % i).encode()).digest()
+
+    def test_python_backend(self):
+        py = KEY_BACKENDS['python']
+        high_s = 0
+        for secret, hash in self.samples():
+            pubkey = py.pubkey(secret, True)
+            for low_s in (True, False):
+                sig = py.sign(secret, hash, low_s)
+                r, s = der_decode_sig(sig)
+                if low_s:
+                    self.assertLessEqual(s, SECP256K1_ORDER_HALF)
+                else:
+                    high_s += s > SECP256K1_ORDER_HALF
+                self.assertTrue(py.verify(pubkey, hash, sig))
+                self.assertFalse(py.verify(pubkey, bytes(32), sig))
+        # low_s=False must keep the S the nonce gives, which is sometimes high
+        self.assertGreater(high_s, 0)
+
+    @unittest.skipIf(coincurve is None, "coincurve is not installed")
+    def test_coincurve_backend(self):
+        py, cc = KEY_BACKENDS['python'], KEY_BACKENDS['coincurve']
+        items = list(self.samples())
+        for low_s in (True, False):
+            sigs = py.sign_batch(items, low_s)
+            self.assertEqual(cc.sign_batch(items, low_s), sigs)
+            for (secret, hash), sig in zip(items, sigs):
+                self.assertEqual(cc.sign(secret, hash, low_s), sig)
+                pubkey = py.pubkey(secret, False)
+                self.assertEqual(cc.pubkey(secret, False), pubkey)
+                self.assertTrue(cc.verify(pubkey, hash, sig))
+                self.assertFalse(cc.verify(pubkey, bytes(32), sig))
+        secret, other = items[0][0], py.pubkey(items[1][0], True)
+        self.assertEqual(cc.ecdh(secret, other), py.ecdh(secret, other))
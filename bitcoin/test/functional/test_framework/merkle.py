@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Merkle trees of transaction hashes.
+
+MerkleTree keeps every level of the tree, so changing, appending or proving
+one leaf only touches the path from it to the root. It follows bitcoind's
+rules: a level with an odd number of nodes pairs its last node with itself.
+"""
+import hashlib
+
+def hash256(s):
+    return hashlib.sha256(hashlib.sha256(s).digest()).digest()
+
+class MerkleTree():
+    """A merkle tree over a list of 32-byte leaf hashes (e.g. serialized txids)"""
+    __slots__ = ("levels",)
+
+    def __init__(self, leaves=()):
+        self.build(list(leaves))
+
+    def build(self, leaves):
+        """Rebuild the whole tree over leaves."""
+        self.levels = [leaves]
+        level = leaves
+        while len(level) > 1:
+            level = [hash256(level[i] + level[min(i + 1, len(level) - 1)]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def root(self):
+        if not self.levels[0]:
+            raise IndexError("Merkle tree has no leaves")
+        return self.levels[-1][0]
+
+    def _update_path(self, i):
+        """Recompute the nodes above leaf i, adding nodes and levels as needed."""
+        for height in range(len(self.levels)):
+            level = self.levels[height]
+            if len(level) == 1 and height == len(self.levels) - 1:
+                return
+            if height == len(self.levels) - 1:
+                self.levels.append([])
+            left = i & ~1
+            node = hash256(level[left] + level[min(left + 1, len(level) - 1)])
+            i >>= 1
+            parents = self.levels[height + 1]
+            if i == len(parents):
+                parents.append(node)
+            else:
+                parents[i] = node
+
+    def update(self, i, leaf):
+        """Change leaf i."""
+        self.levels[0][i] = leaf
+        self._update_path(i)
+
+    def append(self, leaf):
+        self.levels[0].append(leaf)
+        self._update_path(len(self.levels[0]) - 1)
+
+    def set_leaves(self, leaves):
+        """Make the tree match leaves, only updating the leaves that differ."""
+        current = self.levels[0]
+        if len(leaves) < len(current):
+            self.build(list(leaves))
+            return
+        if current != leaves[:len(current)]:
+            changed = [i for i in range(len(current)) if current[i] != leaves[i]]
+            if len(changed) * len(self.levels) > len(current):
+                self.build(list(leaves))
+                return
+            for i in changed:
+                self.update(i, leaves[i])
+        for leaf in leaves[len(current):]:
+            self.append(leaf)
+
+    def proof(self, i):
+        """The hashes leaf i is combined with on its way to the root, bottom first."""
+        branch = []
+        for level in self.levels[:-1]:
+            branch.append(level[min(i ^ 1, len(level) - 1)])
+            i >>= 1
+        return branch
+
+    @staticmethod
+    def root_from_proof(leaf, i, branch):
+        """The root that leaf at position i and its proof hash to."""
+        for sibling in branch:
+            leaf = hash256(sibling + leaf) if i & 1 else hash256(leaf + sibling)
+            i >>= 1
+        return leaf
+
+    def partial(self, matches):
+        """The bits and hashes of a partial merkle tree of the matching leaves.
+
+        matches has one boolean per leaf. Built like bitcoind's
+        CPartialMerkleTree, with hashes taken from the stored levels."""
+        bits = []
+        hashes = []
+        n = len(self.levels[0])
+
+        def traverse(height, pos):
+            parent_of_match = any(matches[pos << height:min((pos + 1) << height, n)])
+            bits.append(parent_of_match)
+            if height == 0 or not parent_of_match:
+                hashes.append(self.levels[height][pos])
+            else:
+                traverse(height - 1, pos * 2)
+                if pos * 2 + 1 < len(self.levels[height - 1]):
+                    traverse(height - 1, pos * 2 + 1)
+
+        traverse(len(self.levels) - 1, 0)
+        return bits, hashes
@@ -15,6 +15,8 @@ msg_block, msg_tx, msg_headers, etc.:
 
 ser_*, deser_*: functions that handle serialization/deserialization.
 
+deser_*_from, deserialize_from: one-pass deserialization from a buffer.
+
 Classes use __slots__ to ensure extraneous attributes aren't accidentally added
 by tests, compromising their intended effect.
 """
@@ -26,8 +28,10 @@ import random
 import socket
 import struct
 import time
+from collections.abc import MutableSequence
 
-from test_framework.siphash import siphash256
+from test_framework.merkle import MerkleTree
+from test_framework.siphash import siphash256, siphash256_batch
 from test_framework.util import hex_str_to_bytes, bytes_to_hex_str
 
 MIN_VERSION_SUPPORTED = 60001
@@ -53,6 +57,8 @@ MSG_BLOCK = 2
 MSG_WITNESS_FLAG = 1 << 30
 MSG_TYPE_MASK = 0xffffffff >> 2
 
+UINT256_MASK = (1 << 256) - 1
+
 # Serialization/deserialization tools
 def sha256(s):
     return hashlib.new('sha256', s).digest()
@@ -90,27 +96,15 @@ def ser_string(s):
     return ser_compact_size(len(s)) + s
 
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = struct.unpack("<I", f.read(4))[0]
-        r += t << (i * 32)
-    return r
+    return int.from_bytes(f.read(32), "little")
 
 
 def ser_uint256(u):
-    rs = b""
-    for i in range(8):
-        rs += struct.pack("<I", u & 0xFFFFFFFF)
-        u >>= 32
-    return rs
+    return (u & UINT256_MASK).to_bytes(32, "little")
 
 
 def uint256_from_str(s):
-    r = 0
-    t = struct.unpack("<IIIIIIII", s[:32])
-    for i in range(8):
-        r += t[i] << (i * 32)
-    return r
+    return int.from_bytes(s[:32], "little")
 
 
 def uint256_from_compact(c):
@@ -133,13 +127,12 @@ def deser_vector(f, c):
 # entries in the vector (we use this for serializing the vector of transactions
 # for a witness block).
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
-    for i in l:
-        if ser_function_name:
-            r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
-    return r
+    if ser_function_name:
+        items = [getattr(i, ser_function_name)() for i in l]
+    else:
+        items = [i.serialize() for i in l]
+    # Joining once avoids copying the growing result for every item
+    return ser_compact_size(len(l)) + b"".join(items)
 
 
 def deser_uint256_vector(f):
@@ -174,6 +167,149 @@ def ser_string_vector(l):
     return r
 
 
+# Fast-path deserialization: the *_from functions parse from any buffer
+# (bytes, bytearray, memoryview) at an offset and return the new offset,
+# instead of reading field by field through a file object.
+S_UINT16 = struct.Struct("<H")
+S_INT32 = struct.Struct("<i")
+S_UINT32 = struct.Struct("<I")
+S_INT64 = struct.Struct("<q")
+S_UINT64 = struct.Struct("<Q")
+S_OUTPOINT = struct.Struct("<32sI")
+S_BLOCK_HEADER = struct.Struct("<i32s32sIII")
+
+def deser_compact_size_from(buf, pos):
+    nit = buf[pos]
+    if nit < 253:
+        return nit, pos + 1
+    if nit == 253:
+        return S_UINT16.unpack_from(buf, pos + 1)[0], pos + 3
+    if nit == 254:
+        return S_UINT32.unpack_from(buf, pos + 1)[0], pos + 5
+    return S_UINT64.unpack_from(buf, pos + 1)[0], pos + 9
+
+def deser_string_from(buf, pos):
+    nit, pos = deser_compact_size_from(buf, pos)
+    end = pos + nit
+    if end > len(buf):
+        raise ValueError("string of %i bytes at offset %i overruns buffer" % (nit, pos))
+    return bytes(buf[pos:end]), end
+
+def deser_string_vector_from(buf, pos):
+    nit, pos = deser_compact_size_from(buf, pos)
+    r = []
+    for i in range(nit):
+        t, pos = deser_string_from(buf, pos)
+        r.append(t)
+    return r, pos
+
+def skip_transaction_from(buf, pos):
+    """Return the offset just past the transaction at pos, without decoding it."""
+    start = pos
+    pos += 4
+    nin, pos = deser_compact_size_from(buf, pos)
+    flags = 0
+    if nin == 0:
+        flags = buf[pos]
+        pos += 1
+        if flags != 0:
+            nin, pos = deser_compact_size_from(buf, pos)
+    for i in range(nin):
+        n, pos = deser_compact_size_from(buf, pos + 36)
+        pos += n + 4
+    if nin or flags:
+        nout, pos = deser_compact_size_from(buf, pos)
+        for i in range(nout):
+            n, pos = deser_compact_size_from(buf, pos + 8)
+            pos += n
+    if flags != 0:
+        for i in range(nin):
+            nitems, pos = deser_compact_size_from(buf, pos)
+            for j in range(nitems):
+                n, pos = deser_compact_size_from(buf, pos)
+                pos += n
+    pos += 4
+    if pos > len(buf):
+        raise ValueError("transaction at offset %i overruns buffer" % start)
+    return pos
+
+def skip_block_from(buf, pos):
+    """Return the offset just past the block at pos, without decoding it."""
+    ntx, pos = deser_compact_size_from(buf, pos + S_BLOCK_HEADER.size)
+    for i in range(ntx):
+        pos = skip_transaction_from(buf, pos)
+    return pos
+
+def deser_with(obj, f, skip):
+    """Deserialize obj from f via the fast path, if f is a BytesIO.
+
+    skip finds the end of the object, so only its bytes are copied out of
+    the stream: parsing bytes is faster than parsing a memoryview."""
+    if not isinstance(f, BytesIO):
+        return False
+    start = f.tell()
+    with f.getbuffer() as view:
+        end = skip(view, start)
+        data = bytes(view[start:end])
+    obj.deserialize_from(data)
+    f.seek(end)
+    return True
+
+
+class LazyTransactions(MutableSequence):
+    """The transactions of a serialized block, decoded on first access.
+
+    Only the offset of each transaction is recorded up front. Indexing
+    decodes (and keeps) the CTransaction at that position; the list can be
+    modified like the plain list in CBlock.vtx."""
+    __slots__ = ("_buf", "_offsets", "_txs")
+
+    def __init__(self, buf, offsets):
+        self._buf = buf
+        self._offsets = offsets
+        self._txs = [None] * len(offsets)
+
+    def _get(self, i):
+        tx = self._txs[i]
+        if tx is None:
+            tx = CTransaction()
+            tx.deserialize_from(self._buf, self._offsets[i])
+            self._txs[i] = tx
+        return tx
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(len(self._txs)))]
+        return self._get(range(len(self._txs))[i])
+
+    def __setitem__(self, i, tx):
+        if isinstance(i, slice):
+            tx = list(tx)
+            self._offsets[i] = [None] * len(tx)
+        self._txs[i] = tx
+
+    def __delitem__(self, i):
+        del self._offsets[i]
+        del self._txs[i]
+
+    def __len__(self):
+        return len(self._txs)
+
+    def insert(self, i, tx):
+        self._offsets.insert(i, None)
+        self._txs.insert(i, tx)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __deepcopy__(self, memo):
+        # The buffer may be a memoryview, which can't be copied
+        return copy.deepcopy(list(self), memo)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 # Deserialize from a hex string representation (eg from RPC)
 def FromHex(obj, hex_string):
     obj.deserialize(BytesIO(hex_str_to_bytes(hex_string)))
@@ -426,15 +562,25 @@ class CTransaction:
             self.sha256 = None
             self.hash = None
         else:
+            # Copied field by field, which is much cheaper than
+            # copy.deepcopy: the fields themselves are ints and bytes,
+            # so only the components and lists need new objects.
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [CTxIn(COutPoint(txin.prevout.hash, txin.prevout.n),
+                              txin.scriptSig, txin.nSequence) for txin in tx.vin]
+            self.vout = [CTxOut(txout.nValue, txout.scriptPubKey) for txout in tx.vout]
             self.nLockTime = tx.nLockTime
             self.sha256 = tx.sha256
             self.hash = tx.hash
-            self.wit = copy.deepcopy(tx.wit)
+            self.wit = CTxWitness()
+            for inwit in tx.wit.vtxinwit:
+                wit = CTxInWitness()
+                wit.scriptWitness.stack = list(inwit.scriptWitness.stack)
+                self.wit.vtxinwit.append(wit)
 
     def deserialize(self, f):
+        if deser_with(self, f, skip_transaction_from):
+            return
         self.nVersion = struct.unpack("<i", f.read(4))[0]
         self.vin = deser_vector(f, CTxIn)
         flags = 0
@@ -454,6 +600,79 @@ class CTransaction:
         self.sha256 = None
         self.hash = None
 
+    def deserialize_from(self, buf, pos=0):
+        """Deserialize from buf at pos in one pass, return the offset past the transaction."""
+        start = pos
+        size = len(buf)
+        unpack_outpoint = S_OUTPOINT.unpack_from
+        unpack_uint32 = S_UINT32.unpack_from
+        unpack_int64 = S_INT64.unpack_from
+        from_bytes = int.from_bytes
+        # Every field is set below, so skip the constructors' defaults
+        new = object.__new__
+
+        self.nVersion = S_INT32.unpack_from(buf, pos)[0]
+        pos += 4
+        nin, pos = deser_compact_size_from(buf, pos)
+        flags = 0
+        if nin == 0:
+            flags = buf[pos]
+            pos += 1
+            if flags != 0:
+                nin, pos = deser_compact_size_from(buf, pos)
+        vin = []
+        for i in range(nin):
+            txid, n = unpack_outpoint(buf, pos)
+            outpoint = new(COutPoint)
+            outpoint.hash = from_bytes(txid, "little")
+            outpoint.n = n
+            txin = new(CTxIn)
+            txin.prevout = outpoint
+            pos += 36
+            nit = buf[pos]
+            if nit < 253:
+                pos += 1
+            else:
+                nit, pos = deser_compact_size_from(buf, pos)
+            txin.scriptSig = bytes(buf[pos:pos + nit])
+            pos += nit
+            txin.nSequence = unpack_uint32(buf, pos)[0]
+            pos += 4
+            vin.append(txin)
+        vout = []
+        if nin or flags:
+            nout, pos = deser_compact_size_from(buf, pos)
+            for i in range(nout):
+                txout = new(CTxOut)
+                txout.nValue = unpack_int64(buf, pos)[0]
+                pos += 8
+                nit = buf[pos]
+                if nit < 253:
+                    pos += 1
+                else:
+                    nit, pos = deser_compact_size_from(buf, pos)
+                txout.scriptPubKey = bytes(buf[pos:pos + nit])
+                pos += nit
+                vout.append(txout)
+        if pos > size:
+            raise ValueError("transaction at offset %i overruns buffer" % start)
+        self.vin = vin
+        self.vout = vout
+        self.wit = CTxWitness()
+        if flags != 0:
+            vtxinwit = []
+            for i in range(nin):
+                wit = CTxInWitness()
+                wit.scriptWitness.stack, pos = deser_string_vector_from(buf, pos)
+                vtxinwit.append(wit)
+            self.wit.vtxinwit = vtxinwit
+        if pos + 4 > size:
+            raise ValueError("transaction at offset %i overruns buffer" % start)
+        self.nLockTime = unpack_uint32(buf, pos)[0]
+        self.sha256 = None
+        self.hash = None
+        return pos + 4
+
     def serialize_without_witness(self):
         r = b""
         r += struct.pack("<i", self.nVersion)
@@ -503,9 +722,11 @@ class CTransaction:
             # Don't cache the result, just return it
             return uint256_from_str(hash256(self.serialize_with_witness()))
 
+        # Serialize and hash once for both sha256 and hash
+        txid = hash256(self.serialize_without_witness())
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = encode(hash256(self.serialize_without_witness())[::-1], 'hex_codec').decode('ascii')
+            self.sha256 = uint256_from_str(txid)
+        self.hash = encode(txid[::-1], 'hex_codec').decode('ascii')
 
     def is_valid(self):
         self.calc_sha256()
@@ -519,6 +740,24 @@ class CTransaction:
             % (self.nVersion, repr(self.vin), repr(self.vout), repr(self.wit), self.nLockTime)
 
 
+def find_nonce(prefix, target, start=0, stop=1 << 32):
+    """Find the first nonce in [start, stop) solving a block header.
+
+    prefix is the header serialized up to the nonce (76 bytes). Its SHA256
+    midstate is computed once, so each nonce costs hashing 16 more bytes
+    and the outer SHA256. Returns None if no nonce in the range hashes to
+    at most target."""
+    midstate = hashlib.sha256(prefix)
+    pack = S_UINT32.pack
+    from_bytes = int.from_bytes
+    for nonce in range(start, stop):
+        h = midstate.copy()
+        h.update(pack(nonce))
+        if from_bytes(hashlib.sha256(h.digest()).digest(), "little") <= target:
+            return nonce
+    return None
+
+
 class CBlockHeader:
     __slots__ = ("hash", "hashMerkleRoot", "hashPrevBlock", "nBits", "nNonce",
                  "nTime", "nVersion", "sha256")
@@ -557,6 +796,15 @@ class CBlockHeader:
         self.sha256 = None
         self.hash = None
 
+    def deserialize_from(self, buf, pos=0):
+        (self.nVersion, prev, merkle, self.nTime, self.nBits,
+         self.nNonce) = S_BLOCK_HEADER.unpack_from(buf, pos)
+        self.hashPrevBlock = int.from_bytes(prev, "little")
+        self.hashMerkleRoot = int.from_bytes(merkle, "little")
+        self.sha256 = None
+        self.hash = None
+        return pos + S_BLOCK_HEADER.size
+
     def serialize(self):
         r = b""
         r += struct.pack("<i", self.nVersion)
@@ -576,8 +824,9 @@ class CBlockHeader:
             r += struct.pack("<I", self.nTime)
             r += struct.pack("<I", self.nBits)
             r += struct.pack("<I", self.nNonce)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            h = hash256(r)
+            self.sha256 = uint256_from_str(h)
+            self.hash = encode(h[::-1], 'hex_codec').decode('ascii')
 
     def rehash(self):
         self.sha256 = None
@@ -591,16 +840,43 @@ class CBlockHeader:
 
 
 class CBlock(CBlockHeader):
-    __slots__ = ("vtx",)
+    __slots__ = ("vtx", "_merkle_tree", "_witness_merkle_tree")
 
     def __init__(self, header=None):
         super(CBlock, self).__init__(header)
         self.vtx = []
+        self._merkle_tree = None
+        self._witness_merkle_tree = None
 
     def deserialize(self, f):
+        if deser_with(self, f, skip_block_from):
+            return
         super(CBlock, self).deserialize(f)
         self.vtx = deser_vector(f, CTransaction)
 
+    def deserialize_from(self, buf, pos=0, lazy=False):
+        """Deserialize from buf at pos, return the offset past the block.
+
+        With lazy=True, only the transaction offsets are recorded and vtx
+        decodes each transaction on first access. buf must then stay
+        unchanged while the block is in use."""
+        pos = super(CBlock, self).deserialize_from(buf, pos)
+        ntx, pos = deser_compact_size_from(buf, pos)
+        if lazy:
+            offsets = []
+            for i in range(ntx):
+                offsets.append(pos)
+                pos = skip_transaction_from(buf, pos)
+            self.vtx = LazyTransactions(buf, offsets)
+        else:
+            vtx = []
+            for i in range(ntx):
+                tx = CTransaction()
+                pos = tx.deserialize_from(buf, pos)
+                vtx.append(tx)
+            self.vtx = vtx
+        return pos
+
     def serialize(self, with_witness=False):
         r = b""
         r += super(CBlock, self).serialize()
@@ -621,23 +897,54 @@ class CBlock(CBlockHeader):
             hashes = newhashes
         return uint256_from_str(hashes[0])
 
-    def calc_merkle_root(self):
-        hashes = []
-        for tx in self.vtx:
-            tx.calc_sha256()
-            hashes.append(ser_uint256(tx.sha256))
-        return self.get_merkle_root(hashes)
-
-    def calc_witness_merkle_root(self):
+    # The merkle trees are kept between calls. By default every
+    # transaction is rehashed, as tests modify transactions in place, and
+    # only the paths of leaves whose hash changed are recomputed. Callers
+    # that know which transactions changed since the previous call can
+    # pass their indices in changed: only those, and any transactions
+    # appended since, are rehashed. Removing transactions rebuilds the tree.
+    @staticmethod
+    def _update_tree(tree, leaf, num_leaves, changed):
+        if tree is None:
+            return MerkleTree(leaf(i) for i in range(num_leaves))
+        if changed is None:
+            tree.set_leaves([leaf(i) for i in range(num_leaves)])
+        elif num_leaves < len(tree):
+            tree.build([leaf(i) for i in range(num_leaves)])
+        else:
+            for i in sorted(set(changed)):
+                if i < len(tree):
+                    tree.update(i, leaf(i))
+            for i in range(len(tree), num_leaves):
+                tree.append(leaf(i))
+        return tree
+
+    def _txid_leaf(self, i):
+        tx = self.vtx[i]
+        tx.calc_sha256()
+        return ser_uint256(tx.sha256)
+
+    def _wtxid_leaf(self, i):
         # For witness root purposes, the hash of the
         # coinbase, with witness, is defined to be 0...0
-        hashes = [ser_uint256(0)]
+        if i == 0:
+            return ser_uint256(0)
+        # Calculate the hashes with witness data
+        return ser_uint256(self.vtx[i].calc_sha256(True))
 
-        for tx in self.vtx[1:]:
-            # Calculate the hashes with witness data
-            hashes.append(ser_uint256(tx.calc_sha256(True)))
+    def merkle_tree(self, changed=None):
+        self._merkle_tree = self._update_tree(self._merkle_tree, self._txid_leaf, len(self.vtx), changed)
+        return self._merkle_tree
 
-        return self.get_merkle_root(hashes)
+    def witness_merkle_tree(self, changed=None):
+        self._witness_merkle_tree = self._update_tree(self._witness_merkle_tree, self._wtxid_leaf, len(self.vtx), changed)
+        return self._witness_merkle_tree
+
+    def calc_merkle_root(self, changed=None):
+        return uint256_from_str(self.merkle_tree(changed).root())
+
+    def calc_witness_merkle_root(self, changed=None):
+        return uint256_from_str(self.witness_merkle_tree(changed).root())
 
     def is_valid(self):
         self.calc_sha256()
@@ -654,8 +961,11 @@ class CBlock(CBlockHeader):
     def solve(self):
         self.rehash()
         target = uint256_from_compact(self.nBits)
-        while self.sha256 > target:
-            self.nNonce += 1
+        if self.sha256 > target:
+            nonce = find_nonce(CBlockHeader.serialize(self)[:76], target, self.nNonce + 1)
+            if nonce is None:
+                raise ValueError("No nonce above %i solves the block" % self.nNonce)
+            self.nNonce = nonce
             self.rehash()
 
     def __repr__(self):
@@ -751,6 +1061,10 @@ def calculate_shortid(k0, k1, tx_hash):
     expected_shortid &= 0x0000ffffffffffff
     return expected_shortid
 
+# The shortids of many transaction hashes under the same keys
+def calculate_shortids(k0, k1, tx_hashes):
+    return [h & 0x0000ffffffffffff for h in siphash256_batch(k0, k1, tx_hashes)]
+
 
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
@@ -806,17 +1120,85 @@ class HeaderAndShortIDs:
         self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
+        prefilled = set(prefill_list)
+        tx_hashes = []
         for i in range(len(block.vtx)):
-            if i not in prefill_list:
+            if i not in prefilled:
                 tx_hash = block.vtx[i].sha256
                 if use_witness:
                     tx_hash = block.vtx[i].calc_sha256(with_witness=True)
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+                tx_hashes.append(tx_hash)
+        self.shortids = calculate_shortids(k0, k1, tx_hashes)
 
     def __repr__(self):
         return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
 
 
+# Reconstructs blocks from a compact block, like bitcoind's
+# PartiallyDownloadedBlock. Index the transactions the receiver already has
+# (e.g. those sent to the node), then reconstruct() returns the block, or the
+# absolute indexes to ask for in a getblocktxn. Once the blocktxn arrives,
+# reconstruct(block_transactions) fills them in.
+class ShortIDIndex:
+    __slots__ = ("header_and_shortids", "keys", "txs", "collisions")
+
+    def __init__(self, header_and_shortids, txs=()):
+        self.header_and_shortids = header_and_shortids
+        self.keys = header_and_shortids.get_siphash_keys()
+        self.txs = {}
+        self.collisions = set()
+        self.add(txs)
+
+    def _tx_hash(self, tx):
+        if self.header_and_shortids.use_witness:
+            return tx.calc_sha256(with_witness=True)
+        if tx.sha256 is None:
+            tx.calc_sha256()
+        return tx.sha256
+
+    def add(self, txs):
+        txs = list(txs)
+        tx_hashes = [self._tx_hash(tx) for tx in txs]
+        for shortid, tx_hash, tx in zip(calculate_shortids(self.keys[0], self.keys[1], tx_hashes), tx_hashes, txs):
+            other = self.txs.setdefault(shortid, tx)
+            if other is not tx and self._tx_hash(other) != tx_hash:
+                # Two candidates share a shortid: bitcoind requests such
+                # transactions instead of guessing.
+                self.collisions.add(shortid)
+
+    def get(self, shortid):
+        if shortid in self.collisions:
+            return None
+        return self.txs.get(shortid)
+
+    def _vtx(self):
+        cmpct = self.header_and_shortids
+        vtx = [None] * (len(cmpct.prefilled_txn) + len(cmpct.shortids))
+        for p in cmpct.prefilled_txn:
+            vtx[p.index] = p.tx
+        shortids = iter(cmpct.shortids)
+        for i in range(len(vtx)):
+            if vtx[i] is None:
+                vtx[i] = self.get(next(shortids))
+        return vtx
+
+    def reconstruct(self, block_transactions=None):
+        """Returns (block, []) or (None, missing absolute indexes)."""
+        vtx = self._vtx()
+        missing = [i for i, tx in enumerate(vtx) if tx is None]
+        if block_transactions is not None:
+            if len(block_transactions.transactions) != len(missing):
+                raise ValueError("blocktxn has %d transactions for %d missing" % (len(block_transactions.transactions), len(missing)))
+            for i, tx in zip(missing, block_transactions.transactions):
+                vtx[i] = tx
+            missing = []
+        if missing:
+            return None, missing
+        block = CBlock(self.header_and_shortids.header)
+        block.vtx = vtx
+        return block, []
+
+
 class BlockTransactionsRequest:
     __slots__ = ("blockhash", "indexes")
 
@@ -885,10 +1267,14 @@ class BlockTransactions:
 class CPartialMerkleTree:
     __slots__ = ("nTransactions", "vBits", "vHash")
 
-    def __init__(self):
+    def __init__(self, tree=None, matches=None):
         self.nTransactions = 0
         self.vHash = []
         self.vBits = []
+        if tree is not None:
+            self.nTransactions = len(tree)
+            self.vBits, hashes = tree.partial(matches)
+            self.vHash = [uint256_from_str(h) for h in hashes]
 
     def deserialize(self, f):
         self.nTransactions = struct.unpack("<i", f.read(4))[0]
@@ -915,9 +1301,16 @@ class CPartialMerkleTree:
 class CMerkleBlock:
     __slots__ = ("header", "txn")
 
-    def __init__(self):
-        self.header = CBlockHeader()
-        self.txn = CPartialMerkleTree()
+    def __init__(self, block=None, txids=()):
+        if block is None:
+            self.header = CBlockHeader()
+            self.txn = CPartialMerkleTree()
+        else:
+            # Proves the transactions of block with their txid in txids
+            self.header = CBlockHeader(block)
+            txids = set(txids)
+            tree = block.merkle_tree()
+            self.txn = CPartialMerkleTree(tree, [tx.sha256 in txids for tx in block.vtx])
 
     def deserialize(self, f):
         self.header.deserialize(f)
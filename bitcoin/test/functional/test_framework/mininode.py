@@ -14,7 +14,7 @@ P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
               and can respond correctly to getdata and getheaders messages"""
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from io import BytesIO
 import logging
 import struct
@@ -22,6 +22,7 @@ import sys
 import threading
 
 from test_framework.messages import (
+    CBlock,
     CBlockHeader,
     MIN_VERSION_SUPPORTED,
     msg_addr,
@@ -82,6 +83,9 @@ MESSAGEMAP = {
     b"version": msg_version,
 }
 
+# magic, command, payload length, checksum
+MSG_HEADER = struct.Struct("<4s12si4s")
+
 MAGIC_BYTES = {
     "mainnet": b"\xf9\xbe\xb4\xd9",   # mainnet
     "testnet3": b"\x0b\x11\x09\x07",  # testnet3
@@ -89,6 +93,49 @@ MAGIC_BYTES = {
 }
 
 
+class MessageCache():
+    """Framed wire bytes of block messages.
+
+    Entries are keyed by the block hash and only reused for the very same
+    object. Like the block's sha256, a cached frame is trusted until the
+    block is rehashed, so blocks must not be modified in place under the
+    same hash once they have been framed. P2PDataStore, whose blocks are
+    stored by hash, uses this to serialize and checksum a block once however
+    many peers or getdata requests it is served to.
+
+    The cache is shared by all connections and may be used from any thread."""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def frame(self, message, network, build):
+        """Return build(message), reusing the bytes cached for its object."""
+        obj = getattr(message, "block", None)
+        if not isinstance(obj, CBlock) or obj.sha256 is None:
+            return build(message)
+        key = (type(message), network, obj.sha256)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is obj:
+                self.entries.move_to_end(key)
+                return entry[1]
+        tmsg = build(message)
+        with self.lock:
+            self.entries[key] = (obj, tmsg)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return tmsg
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+message_cache = MessageCache()
+
+
 class P2PConnection(asyncio.Protocol):
     """A low-level connection object to a node's P2P interface.
 
@@ -117,7 +164,8 @@ class P2PConnection(asyncio.Protocol):
         self.dstport = dstport
         # The initial message to send after the connection was made:
         self.on_connection_send_msg = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvpos = 0
         self.network = net
         logger.debug('Connecting to Bitcoin Node: %s:%d' % (self.dstaddr, self.dstport))
 
@@ -141,6 +189,8 @@ class P2PConnection(asyncio.Protocol):
             self.send_message(self.on_connection_send_msg)
             self.on_connection_send_msg = None  # Never used again
         self.on_open()
+        with mininode_lock:
+            mininode_lock.notify_all()
 
     def connection_lost(self, exc):
         """asyncio callback when a connection is closed."""
@@ -149,8 +199,11 @@ class P2PConnection(asyncio.Protocol):
         else:
             logger.debug("Closed connection to: %s:%d" % (self.dstaddr, self.dstport))
         self._transport = None
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
+        self.recvpos = 0
         self.on_close()
+        with mininode_lock:
+            mininode_lock.notify_all()
 
     # Socket read methods
 
@@ -165,36 +218,57 @@ class P2PConnection(asyncio.Protocol):
 
         This method reads data from the buffer in a loop. It deserializes,
         parses and verifies the P2P header, then passes the P2P payload to
-        the on_message callback for processing."""
+        the on_message callback for processing.
+
+        Messages are parsed in place from recvbuf starting at recvpos, the
+        consumed bytes are only dropped from the buffer once they make up
+        half of it."""
+        try:
+            self._read_messages()
+        except Exception as e:
+            # Views into the buffer may be kept alive by the traceback
+            self.recvbuf = bytearray(self.recvbuf)
+            logger.exception('Error reading message:', repr(e))
+            raise
+        if self.recvpos * 2 >= len(self.recvbuf):
+            del self.recvbuf[:self.recvpos]
+            self.recvpos = 0
+
+    def _read_messages(self):
+        buf = memoryview(self.recvbuf)
         try:
             while True:
-                if len(self.recvbuf) < 4:
-                    return
-                if self.recvbuf[:4] != MAGIC_BYTES[self.network]:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
-                if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                pos = self.recvpos
+                available = len(buf) - pos
+                if available < MSG_HEADER.size:
+                    if available >= 4 and buf[pos:pos+4] != MAGIC_BYTES[self.network]:
+                        raise ValueError("got garbage %s" % repr(buf[pos:].tobytes()))
                     return
-                command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                checksum = self.recvbuf[4+12+4:4+12+4+4]
-                if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                magic, command, msglen, checksum = MSG_HEADER.unpack_from(buf, pos)
+                if magic != MAGIC_BYTES[self.network]:
+                    raise ValueError("got garbage %s" % repr(buf[pos:].tobytes()))
+                if available < MSG_HEADER.size + msglen:
                     return
-                msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                command = command.split(b"\x00", 1)[0]
+                msg = buf[pos+MSG_HEADER.size:pos+MSG_HEADER.size+msglen]
                 th = sha256(msg)
                 h = sha256(th)
                 if checksum != h[:4]:
-                    raise ValueError("got bad checksum " + repr(self.recvbuf))
-                self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+                    raise ValueError("got bad checksum " + repr(buf[pos:].tobytes()))
+                self.recvpos = pos + MSG_HEADER.size + msglen
                 if command not in MESSAGEMAP:
-                    raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(msg)))
+                    raise ValueError("Received unknown command from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, command, repr(msg.tobytes())))
+                # Deserializing from a BytesIO copy of the payload beats
+                # reading field by field from the view in Python.
                 f = BytesIO(msg)
                 t = MESSAGEMAP[command]()
                 t.deserialize(f)
                 self._log_message("receive", t)
                 self.on_message(t)
-        except Exception as e:
-            logger.exception('Error reading message:', repr(e))
-            raise
+        finally:
+            # Release all views so recvbuf can be resized again
+            msg = None
+            buf.release()
 
     def on_message(self, message):
         """Callback for processing a P2P payload. Must be overridden by derived class."""
@@ -211,6 +285,15 @@ class P2PConnection(asyncio.Protocol):
         self._log_message("send", message)
         return self.send_raw_message(tmsg)
 
+    def send_messages(self, messages):
+        """Send several P2P messages with a single write to the socket."""
+        frames = []
+        for message in messages:
+            frames.append(self.build_message(message))
+            self._log_message("send", message)
+        if frames:
+            self.send_raw_message(b"".join(frames))
+
     def send_raw_message(self, raw_message_bytes):
         if not self.is_connected:
             raise IOError('Not connected')
@@ -308,6 +391,8 @@ class P2PInterface(P2PConnection):
             except:
                 print("ERROR delivering %s (%s)" % (repr(message), sys.exc_info()[0]))
                 raise
+            finally:
+                mininode_lock.notify_all()
 
     # Callback methods. Can be overridden by subclasses in individual test
     # cases to provide custom message handling behaviour.
@@ -429,7 +514,10 @@ class P2PInterface(P2PConnection):
 # P2PConnection acquires this lock whenever delivering a message to a P2PInterface.
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
-mininode_lock = threading.RLock()
+# It is a Condition so that the test logic can wait on it: it's notified every
+# time a message has been delivered or a connection was opened or closed, which
+# wakes up wait_until(..., lock=mininode_lock) right away.
+mininode_lock = threading.Condition(threading.RLock())
 
 
 class NetworkThread(threading.Thread):
@@ -468,16 +556,24 @@ class P2PDataStore(P2PInterface):
         self.tx_store = {}
         self.getdata_requests = []
 
+    def build_message(self, message):
+        """Build a serialized P2P message.
+
+        Blocks are framed once and then served from message_cache."""
+        return message_cache.frame(message, self.network, super().build_message)
+
     def on_getdata(self, message):
         """Check for the tx/block in our stores and if found, reply with an inv message."""
+        replies = []
         for inv in message.inv:
             self.getdata_requests.append(inv.hash)
             if (inv.type & MSG_TYPE_MASK) == MSG_TX and inv.hash in self.tx_store.keys():
-                self.send_message(msg_tx(self.tx_store[inv.hash]))
+                replies.append(msg_tx(self.tx_store[inv.hash]))
             elif (inv.type & MSG_TYPE_MASK) == MSG_BLOCK and inv.hash in self.block_store.keys():
-                self.send_message(msg_block(self.block_store[inv.hash]))
+                replies.append(msg_block(self.block_store[inv.hash]))
             else:
                 logger.debug('getdata message type {} received.'.format(hex(inv.type)))
+        self.send_messages(replies)
 
     def on_getheaders(self, message):
         """Search back through our block store for the locator, and reply with a headers message if found."""
@@ -531,8 +627,7 @@ class P2PDataStore(P2PInterface):
         reject_reason = [reject_reason] if reject_reason else []
         with node.assert_debug_log(expected_msgs=reject_reason):
             if force_send:
-                for b in blocks:
-                    self.send_message(msg_block(block=b))
+                self.send_messages([msg_block(block=b) for b in blocks])
             else:
                 self.send_message(msg_headers([CBlockHeader(blocks[-1])]))
                 wait_until(lambda: blocks[-1].sha256 in self.getdata_requests, timeout=timeout, lock=mininode_lock)
@@ -562,8 +657,7 @@ class P2PDataStore(P2PInterface):
 
         reject_reason = [reject_reason] if reject_reason else []
         with node.assert_debug_log(expected_msgs=reject_reason):
-            for tx in txs:
-                self.send_message(msg_tx(tx))
+            self.send_messages([msg_tx(tx) for tx in txs])
 
             if expect_disconnect:
                 self.wait_for_disconnect()
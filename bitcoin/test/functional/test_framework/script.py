@@ -7,7 +7,7 @@
 This file is modified from python-bitcoinlib.
 """
 
-from .messages import CTransaction, CTxOut, sha256, hash256, uint256_from_str, ser_uint256, ser_string
+from .messages import CTxOut, sha256, hash256, ser_compact_size, ser_uint256, ser_string, ser_vector
 
 from binascii import hexlify
 import hashlib
@@ -603,86 +603,115 @@ def SignatureHash(script, txTo, inIdx, hashtype):
 
     if inIdx >= len(txTo.vin):
         return (HASH_ONE, "inIdx %d out of range (%d)" % (inIdx, len(txTo.vin)))
-    txtmp = CTransaction(txTo)
 
-    for txin in txtmp.vin:
-        txin.scriptSig = b''
-    txtmp.vin[inIdx].scriptSig = FindAndDelete(script, CScript([OP_CODESEPARATOR]))
+    # Serialize the modified transaction directly, rather than copying
+    # txTo and modifying the copy: all inputs get an empty scriptSig but
+    # the one being signed, which gets the script.
+    txin = txTo.vin[inIdx]
+    signed_input = txin.prevout.serialize() + ser_string(FindAndDelete(script, CScript([OP_CODESEPARATOR])))
+    zero_sequence = (hashtype & 0x1f) in (SIGHASH_NONE, SIGHASH_SINGLE)
 
     if (hashtype & 0x1f) == SIGHASH_NONE:
-        txtmp.vout = []
-
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+        outputs = ser_compact_size(0)
 
     elif (hashtype & 0x1f) == SIGHASH_SINGLE:
         outIdx = inIdx
-        if outIdx >= len(txtmp.vout):
-            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txtmp.vout)))
+        if outIdx >= len(txTo.vout):
+            return (HASH_ONE, "outIdx %d out of range (%d)" % (outIdx, len(txTo.vout)))
 
-        tmp = txtmp.vout[outIdx]
-        txtmp.vout = []
-        for i in range(outIdx):
-            txtmp.vout.append(CTxOut(-1))
-        txtmp.vout.append(tmp)
+        outputs = ser_compact_size(outIdx + 1)
+        outputs += CTxOut(-1).serialize() * outIdx
+        outputs += txTo.vout[outIdx].serialize()
 
-        for i in range(len(txtmp.vin)):
-            if i != inIdx:
-                txtmp.vin[i].nSequence = 0
+    else:
+        outputs = ser_vector(txTo.vout)
 
     if hashtype & SIGHASH_ANYONECANPAY:
-        tmp = txtmp.vin[inIdx]
-        txtmp.vin = []
-        txtmp.vin.append(tmp)
+        inputs = ser_compact_size(1) + signed_input + struct.pack("<I", txin.nSequence)
+    else:
+        parts = [ser_compact_size(len(txTo.vin))]
+        for i, txin in enumerate(txTo.vin):
+            if i == inIdx:
+                parts.append(signed_input)
+                parts.append(struct.pack("<I", txin.nSequence))
+            else:
+                parts.append(txin.prevout.serialize())
+                parts.append(b"\x00")
+                parts.append(struct.pack("<I", 0 if zero_sequence else txin.nSequence))
+        inputs = b"".join(parts)
 
-    s = txtmp.serialize_without_witness()
+    s = struct.pack("<i", txTo.nVersion) + inputs + outputs + struct.pack("<I", txTo.nLockTime)
     s += struct.pack(b"<I", hashtype)
 
     hash = hash256(s)
 
     return (hash, None)
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class SigHashCache:
+    """The BIP143 digests of a transaction's prevouts, sequences and outputs.
+
+    Each digest is computed on first use and then shared by the signature
+    hashes of all inputs and hashtypes that are given the same cache.
+    Changes to the witness (e.g. adding signatures) or to scriptSigs don't
+    affect the digests, but the cache must not be reused once the inputs
+    or outputs of the transaction have been modified."""
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.digests = {}
+
+    def _get(self, key, compute):
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = compute()
+        return digest
+
+    def hash_prevouts(self):
+        return self._get("prevouts", lambda: hash256(b"".join(i.prevout.serialize() for i in self.tx.vin)))
+
+    def hash_sequence(self):
+        return self._get("sequence", lambda: hash256(b"".join(struct.pack("<I", i.nSequence) for i in self.tx.vin)))
+
+    def hash_outputs(self):
+        return self._get("outputs", lambda: hash256(b"".join(o.serialize() for o in self.tx.vout)))
+
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
 # for version 0 witnesses.
-def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount):
+def SegwitVersion1SignatureHash(script, txTo, inIdx, hashtype, amount, cache=None):
+    """BIP143 signature hash
+
+    Pass the same SigHashCache of txTo when signing several inputs, so the
+    digests of prevouts, sequences and outputs are only computed once.
+    Without one they are recomputed for every call."""
+    if cache is None:
+        cache = SigHashCache(txTo)
 
-    hashPrevouts = 0
-    hashSequence = 0
-    hashOutputs = 0
+    hashPrevouts = ser_uint256(0)
+    hashSequence = ser_uint256(0)
+    hashOutputs = ser_uint256(0)
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = cache.hash_prevouts()
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
+        hashSequence = cache.hash_sequence()
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = cache.hash_outputs()
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = hash256(serialize_outputs)
 
     ss = bytes()
     ss += struct.pack("<i", txTo.nVersion)
-    ss += ser_uint256(hashPrevouts)
-    ss += ser_uint256(hashSequence)
+    ss += hashPrevouts
+    ss += hashSequence
     ss += txTo.vin[inIdx].prevout.serialize()
     ss += ser_string(script)
     ss += struct.pack("<q", amount)
     ss += struct.pack("<I", txTo.vin[inIdx].nSequence)
-    ss += ser_uint256(hashOutputs)
+    ss += hashOutputs
     ss += struct.pack("<i", txTo.nLockTime)
     ss += struct.pack("<I", hashtype)
 
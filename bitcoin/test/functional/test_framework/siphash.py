@@ -4,9 +4,21 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Specialized SipHash-2-4 implementations.
 
-This implements SipHash-2-4 for 256-bit integers.
+This implements SipHash-2-4 for 256-bit integers, one at a time
+(siphash256) or for many integers under the same key (siphash256_batch).
+The batched version uses NumPy when it is installed.
 """
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Below this many hashes the pure Python loop beats setting up NumPy arrays.
+NUMPY_MIN_BATCH = 32
+
+MASK64 = (1 << 64) - 1
+
 def rotl64(n, b):
     return n >> (64 - b) | (n & ((1 << (64 - b)) - 1)) << b
 
@@ -61,3 +73,90 @@ def siphash256(k0, k1, h):
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     v0, v1, v2, v3 = siphash_round(v0, v1, v2, v3)
     return v0 ^ v1 ^ v2 ^ v3
+
+def _siphash256_python(k0, k1, hashes):
+    """siphash256 with the key set up once and the rounds inlined."""
+    M = MASK64
+    init = (0x736f6d6570736575 ^ k0, 0x646f72616e646f6d ^ k1,
+            0x6c7967656e657261 ^ k0, 0x7465646279746573 ^ k1)
+    result = []
+    for h in hashes:
+        v0, v1, v2, v3 = init
+        for m in (h & M, (h >> 64) & M, (h >> 128) & M, (h >> 192) & M, 0x2000000000000000):
+            v3 ^= m
+            for _ in (0, 1):
+                v0 = (v0 + v1) & M
+                v1 = ((v1 << 13 | v1 >> 51) & M) ^ v0
+                v0 = (v0 << 32 | v0 >> 32) & M
+                v2 = (v2 + v3) & M
+                v3 = ((v3 << 16 | v3 >> 48) & M) ^ v2
+                v0 = (v0 + v3) & M
+                v3 = ((v3 << 21 | v3 >> 43) & M) ^ v0
+                v2 = (v2 + v1) & M
+                v1 = ((v1 << 17 | v1 >> 47) & M) ^ v2
+                v2 = (v2 << 32 | v2 >> 32) & M
+            v0 ^= m
+        v2 ^= 0xFF
+        for _ in (0, 1, 2, 3):
+            v0 = (v0 + v1) & M
+            v1 = ((v1 << 13 | v1 >> 51) & M) ^ v0
+            v0 = (v0 << 32 | v0 >> 32) & M
+            v2 = (v2 + v3) & M
+            v3 = ((v3 << 16 | v3 >> 48) & M) ^ v2
+            v0 = (v0 + v3) & M
+            v3 = ((v3 << 21 | v3 >> 43) & M) ^ v0
+            v2 = (v2 + v1) & M
+            v1 = ((v1 << 17 | v1 >> 47) & M) ^ v2
+            v2 = (v2 << 32 | v2 >> 32) & M
+        result.append(v0 ^ v1 ^ v2 ^ v3)
+    return result
+
+def _siphash256_numpy(k0, k1, hashes):
+    """siphash256 over arrays of uint64 lanes, one lane per hash."""
+    u64 = numpy.uint64
+    words = numpy.frombuffer(b"".join(h.to_bytes(32, "little") for h in hashes), dtype="<u8")
+    words = words.reshape(-1, 4).T.astype(u64)
+    n = len(hashes)
+    v0 = numpy.full(n, 0x736f6d6570736575 ^ k0, dtype=u64)
+    v1 = numpy.full(n, 0x646f72616e646f6d ^ k1, dtype=u64)
+    v2 = numpy.full(n, 0x6c7967656e657261 ^ k0, dtype=u64)
+    v3 = numpy.full(n, 0x7465646279746573 ^ k1, dtype=u64)
+    shifts = {b: (u64(b), u64(64 - b)) for b in (13, 16, 17, 21, 32)}
+
+    def rotl(v, b):
+        left, right = shifts[b]
+        return (v << left) | (v >> right)
+
+    def rounds(count):
+        nonlocal v0, v1, v2, v3
+        for _ in range(count):
+            v0 += v1
+            v1 = rotl(v1, 13)
+            v1 ^= v0
+            v0 = rotl(v0, 32)
+            v2 += v3
+            v3 = rotl(v3, 16)
+            v3 ^= v2
+            v0 += v3
+            v3 = rotl(v3, 21)
+            v3 ^= v0
+            v2 += v1
+            v1 = rotl(v1, 17)
+            v1 ^= v2
+            v2 = rotl(v2, 32)
+
+    for m in (words[0], words[1], words[2], words[3], u64(0x2000000000000000)):
+        v3 ^= m
+        rounds(2)
+        v0 ^= m
+    v2 ^= u64(0xFF)
+    rounds(4)
+    return (v0 ^ v1 ^ v2 ^ v3).tolist()
+
+def siphash256_batch(k0, k1, hashes):
+    """siphash256(k0, k1, h) for every h in hashes, as a list."""
+    if not isinstance(hashes, (list, tuple)):
+        hashes = list(hashes)
+    if numpy is not None and len(hashes) >= NUMPY_MIN_BATCH:
+        return _siphash256_numpy(k0, k1, hashes)
+    return _siphash256_python(k0, k1, hashes)
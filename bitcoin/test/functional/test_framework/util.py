@@ -15,10 +15,16 @@ import os
 import random
 import re
 from subprocess import CalledProcessError
+import threading
 import time
 
+try:
+    import zmq
+except ImportError:
+    zmq = None
+
 from . import coverage
-from .authproxy import AuthServiceProxy, JSONRPCException
+from .authproxy import AuthServiceProxy, JSONRPCException, get_connection_pool
 
 logger = logging.getLogger("TestFramework.utils")
 
@@ -212,10 +218,16 @@ def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf'), lock=N
             with lock:
                 if predicate():
                     return
+                attempt += 1
+                if isinstance(lock, threading.Condition):
+                    # Wake up as soon as the lock's owner notifies a change,
+                    # still polling in case the predicate depends on more.
+                    lock.wait(0.05)
+                    continue
         else:
             if predicate():
                 return
-        attempt += 1
+            attempt += 1
         time.sleep(0.05)
 
     # Print the cause of the timeout
@@ -241,7 +253,7 @@ class PortSeed:
     # Must be initialized with a unique integer for each process
     n = None
 
-def get_rpc_proxy(url, node_number, timeout=None, coveragedir=None):
+def get_rpc_proxy(url, node_number, timeout=None, coveragedir=None, pool_size=None):
     """
     Args:
         url (str): URL of the RPC server to call
@@ -249,6 +261,9 @@ def get_rpc_proxy(url, node_number, timeout=None, coveragedir=None):
 
     Kwargs:
         timeout (int): HTTP timeout in seconds
+        pool_size (int): if set, calls are made over a pool of up to this
+            many keep-alive connections shared by all proxies for `url`, so
+            the proxy may be used from several threads at once
 
     Returns:
         AuthServiceProxy. convenience object for making RPC calls.
@@ -257,6 +272,8 @@ def get_rpc_proxy(url, node_number, timeout=None, coveragedir=None):
     proxy_kwargs = {}
     if timeout is not None:
         proxy_kwargs['timeout'] = timeout
+    if pool_size is not None:
+        proxy_kwargs['pool'] = get_connection_pool(url, size=pool_size, **proxy_kwargs)
 
     proxy = AuthServiceProxy(url, **proxy_kwargs)
     proxy.url = url  # store URL on proxy for info
@@ -375,6 +392,56 @@ def connect_nodes_bi(nodes, a, b):
     connect_nodes(nodes[a], b)
     connect_nodes(nodes[b], a)
 
+class SyncWaiter():
+    """Waits between the polls of a sync loop.
+
+    If pyzmq is available and every node publishes the `topic` ZMQ
+    notification (e.g. "hashblock"), wait() returns as soon as any node
+    publishes one. Otherwise, or if no notification arrives, it backs off
+    exponentially from `min_wait` up to `max_wait` seconds."""
+
+    def __init__(self, rpc_connections, topic, *, min_wait=0.01, max_wait=1):
+        self.delay = min_wait
+        self.max_wait = max_wait
+        self.socket = None
+        if zmq is None:
+            return
+        addresses = []
+        for r in rpc_connections:
+            try:
+                notifications = r.getzmqnotifications()
+            except JSONRPCException:
+                # Built without ZMQ support
+                return
+            address = [n['address'] for n in notifications if n['type'] == 'pub' + topic]
+            if not address:
+                return
+            addresses.append(address[0])
+        self.socket = zmq.Context.instance().socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, topic.encode('ascii'))
+        for address in addresses:
+            self.socket.connect(address)
+
+    def wait(self):
+        if self.socket is None:
+            time.sleep(self.delay)
+        elif self.socket.poll(self.delay * 1000):
+            # Drain everything queued, one recheck covers all of it
+            while self.socket.poll(0):
+                self.socket.recv_multipart()
+        self.delay = min(self.delay * 2, self.max_wait)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
 def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     """
     Wait until everybody has the same tip.
@@ -382,29 +449,39 @@ def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     sync_blocks needs to be called with an rpc_connections set that has least
     one node already synced to the latest, stable tip, otherwise there's a
     chance it might return before all nodes are stably synced.
+
+    Polls are spaced by SyncWaiter, so `wait` is the longest gap between them.
     """
     stop_time = time.time() + timeout
-    while time.time() <= stop_time:
-        best_hash = [x.getbestblockhash() for x in rpc_connections]
-        if best_hash.count(best_hash[0]) == len(rpc_connections):
-            return
-        time.sleep(wait)
+    with SyncWaiter(rpc_connections, "hashblock", max_wait=wait) as waiter:
+        while time.time() <= stop_time:
+            best_hash = [x.getbestblockhash() for x in rpc_connections]
+            if best_hash.count(best_hash[0]) == len(rpc_connections):
+                return
+            waiter.wait()
     raise AssertionError("Block sync timed out:{}".format("".join("\n  {!r}".format(b) for b in best_hash)))
 
 def sync_mempools(rpc_connections, *, wait=1, timeout=60, flush_scheduler=True):
     """
     Wait until everybody has the same transactions in their memory
     pools
+
+    Only the mempool sizes are polled until they agree, the full txid sets
+    are fetched and compared once they do.
     """
     stop_time = time.time() + timeout
-    while time.time() <= stop_time:
-        pool = [set(r.getrawmempool()) for r in rpc_connections]
-        if pool.count(pool[0]) == len(rpc_connections):
-            if flush_scheduler:
-                for r in rpc_connections:
-                    r.syncwithvalidationinterfacequeue()
-            return
-        time.sleep(wait)
+    with SyncWaiter(rpc_connections, "hashtx", max_wait=wait) as waiter:
+        while time.time() <= stop_time:
+            sizes = [r.getmempoolinfo()['size'] for r in rpc_connections]
+            if sizes.count(sizes[0]) == len(rpc_connections):
+                pool = [set(r.getrawmempool()) for r in rpc_connections]
+                if pool.count(pool[0]) == len(rpc_connections):
+                    if flush_scheduler:
+                        for r in rpc_connections:
+                            r.syncwithvalidationinterfacequeue()
+                    return
+            waiter.wait()
+    pool = [set(r.getrawmempool()) for r in rpc_connections]
     raise AssertionError("Mempool sync timed out:{}".format("".join("\n  {!r}".format(m) for m in pool)))
 
 # Transaction/Block functions
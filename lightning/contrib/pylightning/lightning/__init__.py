@@ -1 +1,6 @@
+import sys
+
 from .lightning import LightningRpc, RpcError
+
+if sys.version_info >= (3, 5):
+    from .aio import AsyncLightningRpc  # noqa: F401
@@ -0,0 +1,100 @@
+import asyncio
+import json
+import logging
+
+from .lightning import LightningRpc, RECV_SIZE_MAX
+
+
+class AsyncLightningRpc(LightningRpc):
+    """
+    asyncio RPC client for the `lightningd` daemon.
+
+    Exposes the same methods as `LightningRpc`, but every call returns a
+    coroutine instead of blocking. All calls share a single connection
+    opened with `asyncio.open_unix_connection`, and replies are matched
+    to their requests by id, so a pending call (e.g., `waitinvoice`)
+    costs a future rather than a thread.
+    """
+
+    def __init__(self, socket_path, logger=logging):
+        super(AsyncLightningRpc, self).__init__(socket_path, logger=logger)
+        self.writer = None
+        self.connect_lock = None
+        self.pending = {}
+
+    async def _connect(self):
+        # Created lazily so the lock binds to the loop we're running in.
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.writer is None:
+                reader, writer = await asyncio.open_unix_connection(self.socket_path)
+                asyncio.ensure_future(self._read_loop(reader, writer))
+                self.writer = writer
+        return self.writer
+
+    async def _read_loop(self, reader, writer):
+        buff = bytearray()
+        scanned = 0
+        resp = {'error': 'Connection to RPC server lost.'}
+        try:
+            while True:
+                idx = buff.find(b'\n\n', max(scanned - 1, 0))
+                if idx == -1:
+                    scanned = len(buff)
+                    b = await reader.read(RECV_SIZE_MAX)
+                    if len(b) == 0:
+                        break
+                    buff += b
+                    continue
+                with memoryview(buff) as view:
+                    obj, _ = self.decoder.raw_decode(str(view[:idx], "UTF-8"))
+                del buff[:idx + 2]
+                scanned = 0
+                entry = self.pending.pop(obj.get('id'), None)
+                if entry is None:
+                    self.logger.warning("Discarding response with unknown id %r", obj.get('id'))
+                elif not entry[1].done():
+                    entry[1].set_result(obj)
+        except (OSError, ValueError) as e:
+            resp = {'error': 'Connection to RPC server lost: {}'.format(e)}
+        finally:
+            if self.writer is writer:
+                self.writer = None
+            writer.close()
+            for req_id, (w, fut) in list(self.pending.items()):
+                if w is writer:
+                    del self.pending[req_id]
+                    if not fut.done():
+                        fut.set_result(resp)
+
+    async def call(self, method, payload=None):
+        request = self._request(method, payload)
+        writer = await self._connect()
+        fut = asyncio.get_event_loop().create_future()
+        self.pending[request['id']] = (writer, fut)
+        try:
+            writer.write(json.dumps(request).encode('UTF-8'))
+            await writer.drain()
+            resp = await fut
+        finally:
+            self.pending.pop(request['id'], None)
+        return self._result(request, resp)
+
+    async def aclose(self):
+        """Close the connection, failing any pending calls
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def getpeer(self, peer_id, level=None):
+        """
+        Show peer with {peer_id}, if {level} is set, include {log}s
+        """
+        payload = {
+            "id": peer_id,
+            "level": level
+        }
+        res = await self.call("listpeers", payload)
+        return res.get("peers") and res["peers"][0] or None
@@ -1,6 +1,17 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+import codecs
+import itertools
 import json
 import logging
+import re
 import socket
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
 class RpcError(ValueError):
@@ -13,12 +24,311 @@ class RpcError(ValueError):
         self.error = error
 
 
+RECV_SIZE_MIN = 4096
+RECV_SIZE_MAX = 1 << 20
+
+
+class JsonStreamReader(object):
+    """Incrementally parse a JSON reply while it is read from {sock}
+
+    Only the values we ask for are decoded as a whole; containers can be
+    walked member by member instead, so memory stays bounded by the
+    largest single entry rather than the whole reply.
+    """
+    whitespace = re.compile(r'\s*')
+    # What to look for next, depending on where we are in the value
+    string_special = re.compile(r'["\\]')
+    # Anything but brackets, including complete strings
+    nested_run = re.compile(r'[^][{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^][{}"]*)*')
+    scalar_end = re.compile(r'[\s,:\]}]')
+
+    def __init__(self, sock, decoder):
+        self.sock = sock
+        self.decoder = decoder
+        self.utf8 = codecs.getincrementaldecoder('UTF-8')()
+        self.recv_size = RECV_SIZE_MIN
+        self.text = ''
+        self.pos = 0
+
+    def _recv(self):
+        b = self.sock.recv(self.recv_size)
+        if len(b) == 0:
+            raise ValueError('Connection to RPC server lost.')
+        if len(b) == self.recv_size:
+            self.recv_size = min(self.recv_size * 2, RECV_SIZE_MAX)
+        return self.utf8.decode(b)
+
+    def _fill(self):
+        self.text = self.text[self.pos:] + self._recv()
+        self.pos = 0
+
+    def _peek(self):
+        """Skip whitespace and return the next character
+        """
+        while True:
+            self.pos = self.whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            self._fill()
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError("Malformed response, expected {!r} got {!r}".format(chars, c))
+        self.pos += 1
+        return c
+
+    def _scan(self, text, pos):
+        """Continue scanning the current value in {text} from {pos}
+
+        Returns the offset just past the value, or None if {text} ends
+        before the value does. The scan state is kept across calls, so
+        each received chunk is only looked at once.
+        """
+        while True:
+            if self.escape:
+                if pos >= len(text):
+                    return None
+                pos += 1
+                self.escape = False
+            elif self.in_string:
+                m = self.string_special.search(text, pos)
+                if m is None:
+                    return None
+                pos = m.end()
+                if m.group() == '\\':
+                    self.escape = True
+                else:
+                    self.in_string = False
+                    if self.depth == 0:
+                        return pos
+            elif self.depth:
+                pos = self.nested_run.match(text, pos).end()
+                if pos == len(text):
+                    return None
+                c = text[pos]
+                pos += 1
+                if c == '"':
+                    self.in_string = True
+                elif c in '[{':
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        return pos
+            else:
+                # A number or literal: the reply always continues with a
+                # delimiter, so we never wait for bytes that won't come.
+                m = self.scalar_end.search(text, pos)
+                return None if m is None else m.start()
+
+    def value(self):
+        """Decode the next value as a whole
+
+        The value is only decoded once it has been received completely,
+        so large values are decoded once instead of once per chunk.
+        """
+        c = self._peek()
+        # Most values arrive in a single chunk, just try the buffer first.
+        # Only strings and containers end unambiguously, a number may
+        # still be continued by the next chunk.
+        if c in '"[{':
+            try:
+                obj, self.pos = self.decoder.raw_decode(self.text, self.pos)
+                return obj
+            except ValueError:
+                pass
+        self.escape = False
+        self.in_string = c == '"'
+        self.depth = 1 if c in '[{' else 0
+        start = self.pos + 1 if (self.in_string or self.depth) else self.pos
+        if self._scan(self.text, start) is None:
+            chunks = [self.text[self.pos:]]
+            while True:
+                chunk = self._recv()
+                chunks.append(chunk)
+                if self._scan(chunk, 0) is not None:
+                    break
+            self.text = ''.join(chunks)
+            self.pos = 0
+        obj, self.pos = self.decoder.raw_decode(self.text, self.pos)
+        return obj
+
+    def members(self):
+        """Iterate over the keys of the next object
+
+        The caller must consume the value (using `value`, `members` or
+        `elements`) before advancing to the next key.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Iterate over the decoded entries of the next array
+        """
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._expect(',]') == ']':
+                return
+
+
+class UnixSocket(object):
+    """A connected unix domain socket and any bytes read past the last reply
+    """
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.buff = b''
+        self.closed = False
+
+    def close(self):
+        self.sock.close()
+        self.closed = True
+
+
+class ConnectionPool(object):
+    """A bounded pool of long-lived connections to the RPC socket
+
+    At most {size} connections are open at any time, callers beyond
+    that block until a connection is returned. Connections that fail
+    while in use are closed and replaced on demand.
+    """
+    def __init__(self, socket_path, size):
+        self.socket_path = socket_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, yielding it and whether it is freshly opened
+        """
+        self.slots.acquire()
+        try:
+            try:
+                conn, fresh = self.idle.get_nowait(), False
+            except queue.Empty:
+                conn, fresh = UnixSocket(self.socket_path), True
+            try:
+                yield conn, fresh
+            except Exception:
+                conn.close()
+                raise
+            if not conn.closed:
+                self.idle.put(conn)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        """Close all idle connections
+        """
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class MultiplexedConnection(object):
+    """A single connection shared by any number of concurrent calls
+
+    Requests are written as soon as they are submitted, and a reader
+    thread matches the replies back to their requests by JSON-RPC `id`,
+    so a slow call (e.g., `waitsendpay`) does not hold up the ones sent
+    after it. If the connection is lost all pending calls fail, and the
+    next submission reconnects.
+    """
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.conn = None
+        self.pending = {}
+
+    def _connect(self):
+        conn = UnixSocket(self.rpc.socket_path)
+        reader = threading.Thread(target=self._read_loop, args=(conn,))
+        reader.daemon = True
+        reader.start()
+        return conn
+
+    def _read_loop(self, conn):
+        while True:
+            try:
+                resp, conn.buff = self.rpc._readobj(conn.sock, conn.buff)
+            except (socket.error, ValueError) as e:
+                resp = {'error': 'Connection to RPC server lost: {}'.format(e)}
+            if 'id' not in resp:
+                break
+            with self.lock:
+                fut = self.pending.pop(resp['id'], None)
+            if fut is None:
+                self.rpc.logger.warning("Discarding response with unknown id %r", resp['id'])
+                continue
+            fut.set_result(resp)
+
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+            pending = [f for f in self.pending.values() if f.conn is conn]
+            for fut in pending:
+                del self.pending[fut.request_id]
+        conn.close()
+        for fut in pending:
+            fut.set_result(resp)
+
+    def submit(self, request):
+        """Send {request} and return a future resolving to the raw reply
+        """
+        fut = Future()
+        fut.request_id = request['id']
+        with self.lock:
+            if self.conn is None:
+                self.conn = self._connect()
+            fut.conn = self.conn
+            self.pending[request['id']] = fut
+        try:
+            with self.write_lock:
+                self.rpc._writeobj(fut.conn.sock, request)
+        except socket.error:
+            with self.lock:
+                self.pending.pop(request['id'], None)
+            raise
+        return fut
+
+    def close(self):
+        """Close the connection, failing any pending calls
+        """
+        with self.lock:
+            conn = self.conn
+        if conn is not None:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+
+
 class UnixDomainSocketRpc(object):
-    def __init__(self, socket_path, executor=None, logger=logging):
+    def __init__(self, socket_path, executor=None, logger=logging, pool_size=0,
+                 multiplex=False):
         self.socket_path = socket_path
         self.decoder = json.JSONDecoder()
         self.executor = executor
         self.logger = logger
+        # `next()` on a count is atomic under the GIL, so ids are unique
+        # even when calls come in from multiple threads.
+        self.next_id = itertools.count()
+        self.pool = ConnectionPool(socket_path, pool_size) if pool_size else None
+        self.mux = MultiplexedConnection(self) if multiplex else None
 
     @staticmethod
     def _writeobj(sock, obj):
@@ -26,19 +336,49 @@ class UnixDomainSocketRpc(object):
         sock.sendall(bytearray(s, 'UTF-8'))
 
     def _readobj(self, sock, buff=b''):
-        """Read a JSON object, starting with buff; returns object and any buffer left over"""
+        """Read a JSON object, starting with buff; returns object and any buffer left over
+
+        Only newly received bytes are scanned for the delimiter, and the
+        receive size grows while the socket keeps filling it, so large
+        replies (e.g., `listchannels`) are read in linear time.
+        """
+        buff = bytearray(buff)
+        scanned = 0
+        recv_size = RECV_SIZE_MIN
         while True:
-            parts = buff.split(b'\n\n', 1)
-            if len(parts) == 1:
-                # Didn't read enough.
-                b = sock.recv(1024)
-                buff += b
-                if len(b) == 0:
-                    return {'error': 'Connection to RPC server lost.'}, buff
-            else:
-                buff = parts[1]
-                obj, _ = self.decoder.raw_decode(parts[0].decode("UTF-8"))
+            # The delimiter may straddle the previous and the new bytes.
+            idx = buff.find(b'\n\n', max(scanned - 1, 0))
+            if idx != -1:
+                obj, _ = self.decoder.raw_decode(buff[:idx].decode("UTF-8"))
+                del buff[:idx + 2]
                 return obj, buff
+            scanned = len(buff)
+            b = sock.recv(recv_size)
+            if len(b) == 0:
+                return {'error': 'Connection to RPC server lost.'}, buff
+            buff += b
+            if len(b) == recv_size:
+                recv_size = min(recv_size * 2, RECV_SIZE_MAX)
+
+    def _readstream(self, sock, request, key):
+        """Read the reply to {request}, yielding the entries of `result[key]`
+
+        Entries are yielded as soon as they are parsed, without
+        materializing the rest of the reply.
+        """
+        reader = JsonStreamReader(sock, self.decoder)
+        for k in reader.members():
+            if k == 'error':
+                raise RpcError(request['method'], request['params'], reader.value())
+            elif k != 'result':
+                reader.value()
+                continue
+            for rk in reader.members():
+                if rk != key:
+                    reader.value()
+                    continue
+                for entry in reader.elements():
+                    yield entry
 
     def __getattr__(self, name):
         """Intercept any call that is not explicitly defined and call @call
@@ -52,7 +392,48 @@ class UnixDomainSocketRpc(object):
             return self.call(name, payload=kwargs)
         return wrapper
 
-    def call(self, method, payload=None):
+    def _roundtrip(self, conn, request):
+        """Send {request} on {conn} and read back the reply with its id
+        """
+        self._writeobj(conn.sock, request)
+        return self._readreply(conn, request)
+
+    def _readreply(self, conn, request):
+        while True:
+            resp, conn.buff = self._readobj(conn.sock, conn.buff)
+            if 'id' not in resp or resp['id'] == request['id']:
+                return resp
+            self.logger.warning("Discarding response with unexpected id %r, expected %r",
+                                resp['id'], request['id'])
+
+    def _pooled_roundtrip(self, request):
+        """Perform {request} on a pooled connection
+
+        A reused connection may have been closed by lightningd while it
+        sat idle (e.g., on restart). Only if writing to it fails before
+        any of the request was sent is it retried on another connection:
+        once lightningd may have received it, retrying could run a call
+        like `pay` twice, so failures are reported instead.
+        """
+        data = bytearray(json.dumps(request), 'UTF-8')
+        while True:
+            with self.pool.connection() as (conn, fresh):
+                try:
+                    # A failed send() has not sent anything
+                    sent = conn.sock.send(data)
+                except socket.error:
+                    if fresh:
+                        raise
+                    conn.close()
+                    continue
+                conn.sock.sendall(data[sent:])
+                resp = self._readreply(conn, request)
+                if 'id' not in resp:
+                    # Lost the connection, don't hand it out again.
+                    conn.close()
+                return resp
+
+    def _request(self, method, payload):
         self.logger.debug("Calling %s with payload %r", method, payload)
 
         if payload is None:
@@ -60,17 +441,14 @@ class UnixDomainSocketRpc(object):
         # Filter out arguments that are None
         payload = {k: v for k, v in payload.items() if v is not None}
 
-        # FIXME: we open a new socket for every readobj call...
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(self.socket_path)
-        self._writeobj(sock, {
+        return {
             "method": method,
             "params": payload,
-            "id": 0
-        })
-        resp, _ = self._readobj(sock)
-        sock.close()
+            "id": next(self.next_id)
+        }
 
+    def _result(self, request, resp):
+        method, payload = request['method'], request['params']
         self.logger.debug("Received response for %s call: %r", method, resp)
         if "error" in resp:
             raise RpcError(method, payload, resp['error'])
@@ -78,6 +456,56 @@ class UnixDomainSocketRpc(object):
             raise ValueError("Malformed response, \"result\" missing.")
         return resp["result"]
 
+    def call(self, method, payload=None):
+        request = self._request(method, payload)
+        if self.mux is not None:
+            resp = self.mux.submit(request).result()
+        elif self.pool is not None:
+            resp = self._pooled_roundtrip(request)
+        else:
+            conn = UnixSocket(self.socket_path)
+            try:
+                resp = self._roundtrip(conn, request)
+            finally:
+                conn.close()
+        return self._result(request, resp)
+
+    def call_stream(self, method, key, payload=None):
+        """Perform a call, yielding the entries of the {key} array in its result
+
+        Useful for very large replies, e.g., `call_stream('listchannels',
+        'channels')` yields each channel as soon as it has been read. The
+        call uses its own connection, which is closed once the generator
+        finishes or is discarded.
+        """
+        request = self._request(method, payload)
+        conn = UnixSocket(self.socket_path)
+        try:
+            self._writeobj(conn.sock, request)
+            for entry in self._readstream(conn.sock, request, key):
+                yield entry
+        finally:
+            conn.close()
+
+    def call_async(self, method, payload=None):
+        """Start a call without waiting for it, returning a future for its result
+
+        Requires `multiplex` mode. The future can be awaited from asyncio
+        code with `asyncio.wrap_future`.
+        """
+        if self.mux is None:
+            raise ValueError("call_async requires a multiplexed connection")
+        request = self._request(method, payload)
+        result = Future()
+
+        def done(fut):
+            try:
+                result.set_result(self._result(request, fut.result()))
+            except Exception as e:
+                result.set_exception(e)
+        self.mux.submit(request).add_done_callback(done)
+        return result
+
 
 class LightningRpc(UnixDomainSocketRpc):
     """
@@ -89,8 +517,15 @@ class LightningRpc(UnixDomainSocketRpc):
     keyword argument. If `async` is set to true then the method
     returns a future immediately, instead of blocking indefinitely.
 
-    This implementation is thread safe in that it locks the socket
-    between calls, but it does not (yet) support concurrent calls.
+    By default every call opens a new connection to the socket. Passing
+    `pool_size` keeps up to that many connections open and reuses them
+    across calls, so up to `pool_size` threads (e.g., workers of a
+    `concurrent.futures` executor) can have a call in flight at once.
+
+    With `multiplex=True` all calls share a single connection instead:
+    any number of threads may call concurrently, replies are matched to
+    their requests by id, and `call_async` starts a call and returns a
+    future without tying up a thread while it is pending.
     """
 
     def getpeer(self, peer_id, level=None):
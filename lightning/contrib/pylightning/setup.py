@@ -9,4 +9,5 @@ setup(name='pylightning',
       license='MIT',
       packages=['lightning'],
       scripts=['lightning-pay'],
+      python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*',
       zip_safe=True)
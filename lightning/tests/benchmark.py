@@ -1,25 +1,17 @@
 from concurrent import futures
 from fixtures import *  # noqa: F401,F403
+from lightning import LightningRpc
 from time import time
 from tqdm import tqdm
 
 
-import pytest
 import random
 
 
-num_workers = 480
 num_payments = 10000
 
 
-@pytest.fixture
-def executor():
-    ex = futures.ThreadPoolExecutor(max_workers=num_workers)
-    yield ex
-    ex.shutdown(wait=False)
-
-
-def test_single_hop(node_factory, executor):
+def test_single_hop(node_factory):
     l1 = node_factory.get_node()
     l2 = node_factory.get_node()
 
@@ -36,16 +28,18 @@ def test_single_hop(node_factory, executor):
     print("Sending payments")
     start_time = time()
 
-    def do_pay(i):
-        p = l1.rpc.sendpay(route, i)
-        r = l1.rpc.waitsendpay(p['payment_hash'])
-        return r
-
-    for i in invoices:
-        fs.append(executor.submit(do_pay, i))
-
-    for f in tqdm(futures.as_completed(fs), total=len(fs)):
-        f.result()
+    # All payments are in flight on a single multiplexed connection, so we
+    # don't need a thread per pending `waitsendpay`.
+    rpc = LightningRpc(l1.rpc.socket_path, multiplex=True)
+    try:
+        for i in invoices:
+            rpc.sendpay(route, i)
+            fs.append(rpc.call_async('waitsendpay', {'payment_hash': i}))
+
+        for f in tqdm(futures.as_completed(fs), total=len(fs)):
+            f.result()
+    finally:
+        rpc.mux.close()
 
     diff = time() - start_time
     print("Done. %d payments performed in %f seconds (%f payments per second)" % (num_payments, diff, num_payments / diff))
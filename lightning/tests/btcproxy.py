@@ -5,12 +5,16 @@ from bitcoin.rpc import JSONRPCError
 from bitcoin.rpc import RawProxy as BitcoinProxy
 from cheroot.wsgi import Server
 from cheroot.wsgi import PathInfoDispatcher
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPException
 
 import decimal
 import flask
 import json
 import logging
 import os
+import queue
 import threading
 
 
@@ -23,7 +27,67 @@ class DecimalEncoder(json.JSONEncoder):
         return super(DecimalEncoder, self).default(o)
 
 
+class BitcoinRpcPool(object):
+    """A pool of keep-alive connections to bitcoind.
+
+    Each `RawProxy` holds a single HTTP connection and can't be shared
+    between threads, so callers borrow one for the duration of a call and
+    hand it back afterwards. bitcoind may drop idle connections, so a call
+    that fails on a reused connection is retried once on a fresh one.
+    """
+    def __init__(self, btc_conf_file):
+        self.btc_conf_file = btc_conf_file
+        self.idle = queue.LifoQueue()
+
+    def _discard(self, brpc):
+        # Older python-bitcoinlib has no close(), the connection then goes
+        # away with the proxy.
+        close = getattr(brpc, 'close', None)
+        if close is not None:
+            close()
+
+    def call(self, method, *params):
+        try:
+            brpc, reused = self.idle.get_nowait(), True
+        except queue.Empty:
+            brpc, reused = BitcoinProxy(btc_conf_file=self.btc_conf_file), False
+
+        while True:
+            try:
+                result = brpc._call(method, *params)
+                break
+            except JSONRPCError:
+                # An error reply, the connection itself is still fine.
+                self.idle.put(brpc)
+                raise
+            except (HTTPException, OSError):
+                self._discard(brpc)
+                if not reused:
+                    raise
+                brpc, reused = BitcoinProxy(btc_conf_file=self.btc_conf_file), False
+
+        self.idle.put(brpc)
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+
 class BitcoinRpcProxy(object):
+    # Replies that only depend on their arguments: raw blocks and headers by
+    # hash. Anything that depends on the current tip (including
+    # `getblockhash`, which changes under reorgs) is always forwarded.
+    CACHEABLE = {
+        'getblock': lambda params: len(params) == 2 and params[1] in (False, 0),
+        'getblockheader': lambda params: len(params) == 2 and params[1] is False,
+    }
+    CACHE_SIZE = 1024
+    BATCH_WORKERS = 8
+
     def __init__(self, bitcoind, rpcport=0):
         self.app = Flask("BitcoindProxy")
         self.app.add_url_rule("/", "API entrypoint", self.proxy, methods=['POST'])
@@ -32,24 +96,54 @@ class BitcoinRpcProxy(object):
         self.mock_counts = {}
         self.bitcoind = bitcoind
         self.request_count = 0
+        self.lock = threading.Lock()
+        self.pool = BitcoinRpcPool(os.path.join(bitcoind.bitcoin_dir, 'bitcoin.conf'))
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.executor = None
+
+    def _cache_key(self, method, params):
+        cacheable = self.CACHEABLE.get(method)
+        if cacheable is None or not cacheable(params):
+            return None
+        return (method, json.dumps(params))
+
+    def _forward(self, method, params):
+        key = self._cache_key(method, params)
+        if key is not None:
+            with self.lock:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    self.cache_hits += 1
+                    return self.cache[key]
+
+        result = self.pool.call(method, *params)
+
+        if key is not None:
+            with self.lock:
+                self.cache[key] = result
+                if len(self.cache) > self.CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return result
 
     def _handle_request(self, r):
-        conf_file = os.path.join(self.bitcoind.bitcoin_dir, 'bitcoin.conf')
-        brpc = BitcoinProxy(btc_conf_file=conf_file)
         method = r['method']
 
         # If we have set a mock for this method reply with that instead of
         # forwarding the request.
-        if method in self.mocks and type(method) == dict:
-            self.mock_counts[method] += 1
-            return self.mocks[method]
-        elif method in self.mocks and callable(self.mocks[method]):
-            self.mock_counts[method] += 1
-            return self.mocks[method](r)
+        with self.lock:
+            mock = self.mocks.get(method)
+            if mock is not None and type(method) == dict:
+                self.mock_counts[method] += 1
+                return mock
+            elif mock is not None and callable(mock):
+                self.mock_counts[method] += 1
+        if mock is not None and callable(mock):
+            return mock(r)
 
         try:
             reply = {
-                "result": brpc._call(r['method'], *r['params']),
+                "result": self._forward(method, r['params']),
                 "error": None,
                 "id": r['id']
             }
@@ -58,13 +152,16 @@ class BitcoinRpcProxy(object):
                 "error": e.error,
                 "id": r['id']
             }
-        self.request_count += 1
+        with self.lock:
+            self.request_count += 1
         return reply
 
     def proxy(self):
         r = json.loads(request.data.decode('ASCII'))
 
-        if isinstance(r, list):
+        if isinstance(r, list) and len(r) > 1:
+            reply = list(self.executor.map(self._handle_request, r))
+        elif isinstance(r, list):
             reply = [self._handle_request(subreq) for subreq in r]
         else:
             reply = self._handle_request(r)
@@ -74,6 +171,7 @@ class BitcoinRpcProxy(object):
         return response
 
     def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=self.BATCH_WORKERS)
         d = PathInfoDispatcher({'/': self.app})
         self.server = Server(('0.0.0.0', self.rpcport), d)
         self.proxy_thread = threading.Thread(target=self.server.start)
@@ -91,7 +189,9 @@ class BitcoinRpcProxy(object):
     def stop(self):
         self.server.stop()
         self.proxy_thread.join()
-        logging.debug("BitcoinRpcProxy shut down after processing {} requests".format(self.request_count))
+        self.executor.shutdown()
+        self.pool.close()
+        logging.debug("BitcoinRpcProxy shut down after processing {} requests ({} served from cache)".format(self.request_count, self.cache_hits))
 
     def mock_rpc(self, method, response=None):
         """Mock the response to a future RPC call of @method
@@ -101,8 +201,9 @@ class BitcoinRpcProxy(object):
         is removed and future calls will be passed through to bitcoind again.
 
         """
-        if response is not None:
-            self.mocks[method] = response
-            self.mock_counts[method] = 0
-        elif method in self.mocks:
-            del self.mocks[method]
+        with self.lock:
+            if response is not None:
+                self.mocks[method] = response
+                self.mock_counts[method] = 0
+            elif method in self.mocks:
+                del self.mocks[method]
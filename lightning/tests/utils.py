@@ -1,3 +1,5 @@
+from array import array
+from bisect import bisect_left
 import logging
 import os
 import random
@@ -6,14 +8,15 @@ import shutil
 import sqlite3
 import string
 import subprocess
+import tempfile
 import threading
 import time
 
-from btcproxy import BitcoinRpcProxy
-from bitcoin.rpc import RawProxy as BitcoinProxy
+from btcproxy import BitcoinRpcPool, BitcoinRpcProxy
 from decimal import Decimal
 from ephemeral_port_reserve import reserve
 from lightning import LightningRpc
+from urllib.request import pathname2url
 
 BITCOIND_CONFIG = {
     "regtest": 1,
@@ -80,6 +83,150 @@ def wait_channel_quiescent(n1, n2):
     wait_for(lambda: only_one(only_one(n2.rpc.listpeers(n1.info['id'])['peers'])['channels'])['htlcs'] == [])
 
 
+class LogStore(object):
+    """The lines a process logged, with bounded memory.
+
+    The most recent lines are kept in memory; once there are twice
+    `capacity` of them, the older half is spilled to a temporary file.
+    Lines keep their absolute index either way, so it can be used as a
+    search start (like `TailableProc.logsearch_start`).
+
+    If `subdaemon_regex` is set, its first group names the subdaemon that
+    logged each line (e.g. `lightning_channeld`), and an index from
+    subdaemon to line numbers lets searches skip all other lines.
+
+    Lines are only ever appended, so the outcome of each search is kept
+    (up to `max_searches` of them): repeating a search returns the line
+    found before, or only looks at the lines logged since.
+    """
+    max_searches = 10000
+
+    def __init__(self, capacity=100000, subdaemon_regex=None):
+        self.capacity = capacity
+        self.subdaemon_regex = subdaemon_regex
+        self.lock = threading.RLock()
+        self.recent = []
+        # Absolute index of self.recent[0], i.e. the number of spilled lines
+        self.first = 0
+        self.spill = None
+        self.spill_offsets = array('Q')
+        self.subdaemons = {}
+        # (pattern, flags, start, subdaemon) -> (lines searched, match)
+        self.searches = {}
+
+    def __len__(self):
+        return self.first + len(self.recent)
+
+    def append(self, line):
+        with self.lock:
+            if self.subdaemon_regex is not None:
+                m = self.subdaemon_regex.search(line)
+                if m:
+                    self.subdaemons.setdefault(m.group(1), array('Q')).append(len(self))
+            self.recent.append(line)
+            if len(self.recent) >= 2 * self.capacity:
+                self._spill(self.capacity)
+
+    def _spill(self, count):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile()
+        offset = self.spill.seek(0, os.SEEK_END)
+        data = []
+        for line in self.recent[:count]:
+            self.spill_offsets.append(offset)
+            encoded = line.encode('utf-8') + b'\n'
+            offset += len(encoded)
+            data.append(encoded)
+        self.spill.write(b''.join(data))
+        del self.recent[:count]
+        self.first += count
+
+    def _read_spilled(self, start, stop):
+        """Spilled lines start to stop, caller holds the lock."""
+        if start >= stop:
+            return []
+        begin = self.spill_offsets[start]
+        end = self.spill_offsets[stop] if stop < self.first else self.spill.seek(0, os.SEEK_END)
+        self.spill.seek(begin)
+        return self.spill.read(end - begin).decode('utf-8').split('\n')[:-1]
+
+    def lines(self, start=0, stop=None):
+        """The lines from start up to stop, as a list."""
+        with self.lock:
+            stop = len(self) if stop is None else min(stop, len(self))
+            start = max(start, 0)
+            spilled = self._read_spilled(start, min(stop, self.first))
+            return spilled + self.recent[max(start - self.first, 0):max(stop - self.first, 0)]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            return self.lines(start, stop)[::step] if step > 0 else self.lines()[i]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("log line out of range")
+        return self.lines(i, i + 1)[0]
+
+    def __iter__(self):
+        return iter(self.lines())
+
+    def __reversed__(self):
+        return reversed(self.lines())
+
+    def subdaemon_of(self, line):
+        """The subdaemon that logged line, if known."""
+        if self.subdaemon_regex is None:
+            return None
+        m = self.subdaemon_regex.search(line)
+        return m.group(1) if m else None
+
+    def line_numbers(self, subdaemon, start=0):
+        """Numbers of the lines logged by subdaemon, from start on."""
+        with self.lock:
+            numbers = self.subdaemons.get(subdaemon, array('Q'))
+            return numbers[bisect_left(numbers, start):]
+
+    def search(self, regex, start=0, subdaemon=None):
+        """The first line from start on that matches regex, or None."""
+        ex = re.compile(regex)
+        key = (ex.pattern, ex.flags, start, subdaemon)
+        with self.lock:
+            pos, found = self.searches.get(key, (start, None))
+            if found is not None:
+                return found
+            end = len(self)
+            if subdaemon is None:
+                lines = self.lines(pos, end)
+            else:
+                lines = [self[i] for i in self.line_numbers(subdaemon, pos) if i < end]
+
+        for line in lines:
+            if ex.search(line):
+                found = line
+                break
+
+        with self.lock:
+            if len(self.searches) >= self.max_searches:
+                self.searches.clear()
+            self.searches[key] = (end, found)
+        return found
+
+
+def combine_regexs(exs):
+    """One regex matching any of the compiled `exs`, or None if they can't
+    be combined without changing what they match (flags, backreferences)
+    or at all (e.g. two of them use the same group name)."""
+    default_flags = re.compile('').flags
+    for ex in exs:
+        if ex.flags != default_flags or re.search(r'\\[1-9]|\(\?P=', ex.pattern):
+            return None
+    try:
+        return re.compile('|'.join('(?:{})'.format(ex.pattern) for ex in exs))
+    except re.error:
+        return None
+
+
 class TailableProc(object):
     """A monitorable process that we can start, stop and tail.
 
@@ -87,8 +234,8 @@ class TailableProc(object):
     tail the processes and react to their output.
     """
 
-    def __init__(self, outputDir=None, verbose=True):
-        self.logs = []
+    def __init__(self, outputDir=None, verbose=True, subdaemon_regex=None):
+        self.logs = LogStore(subdaemon_regex=subdaemon_regex)
         self.logs_cond = threading.Condition(threading.RLock())
         self.env = os.environ.copy()
         self.running = False
@@ -161,22 +308,25 @@ class TailableProc(object):
             with self.logs_cond:
                 self.logs.append(str(line.rstrip()))
                 self.logs_cond.notifyAll()
-        self.running = False
+        with self.logs_cond:
+            self.running = False
+            self.logs_cond.notifyAll()
         self.proc.stdout.close()
 
-    def is_in_log(self, regex, start=0):
-        """Look for `regex` in the logs."""
-
-        ex = re.compile(regex)
-        for l in self.logs[start:]:
-            if ex.search(l):
-                logging.debug("Found '%s' in logs", regex)
-                return l
+    def is_in_log(self, regex, start=0, subdaemon=None):
+        """Look for `regex` in the logs.
 
-        logging.debug("Did not find '%s' in logs", regex)
-        return None
+        If `subdaemon` is given (e.g. 'lightning_channeld'), only its lines
+        are searched.
+        """
+        line = self.logs.search(regex, start, subdaemon)
+        if line is not None:
+            logging.debug("Found '%s' in logs", regex)
+        else:
+            logging.debug("Did not find '%s' in logs", regex)
+        return line
 
-    def wait_for_logs(self, regexs, timeout=TIMEOUT):
+    def wait_for_logs(self, regexs, timeout=TIMEOUT, subdaemon=None):
         """Look for `regexs` in the logs.
 
         We tail the stdout of the process and look for each regex in `regexs`,
@@ -184,55 +334,70 @@ class TailableProc(object):
         fail if the timeout is exceeded or if the underlying process
         exits before all the `regexs` were found.
 
+        New lines are checked against a single regex combining all the
+        pending ones, as soon as they are read. If `subdaemon` is given, only
+        its lines are considered.
+
         If timeout is None, no time-out is applied.
         """
         logging.debug("Waiting for {} in the logs".format(regexs))
         exs = [re.compile(r) for r in regexs]
+        combined = combine_regexs(exs)
         start_time = time.time()
         pos = self.logsearch_start
         while True:
-            if timeout is not None and time.time() > start_time + timeout:
-                print("Time-out: can't find {} in logs".format(exs))
-                for r in exs:
-                    if self.is_in_log(r):
-                        print("({} was previously in logs!)".format(r))
-                raise TimeoutError('Unable to find "{}" in logs.'.format(exs))
-            elif not self.running:
-                raise ValueError('Process died while waiting for logs')
-
             with self.logs_cond:
-                if pos >= len(self.logs):
-                    self.logs_cond.wait(1)
+                if timeout is not None and time.time() > start_time + timeout:
+                    print("Time-out: can't find {} in logs".format(exs))
+                    for r in exs:
+                        if self.is_in_log(r):
+                            print("({} was previously in logs!)".format(r))
+                    raise TimeoutError('Unable to find "{}" in logs.'.format(exs))
+
+                lines = self.logs.lines(pos)
+                if not lines:
+                    if not self.running:
+                        raise ValueError('Process died while waiting for logs')
+                    if timeout is None:
+                        self.logs_cond.wait()
+                    else:
+                        self.logs_cond.wait(max(start_time + timeout - time.time(), 0))
                     continue
 
-                for r in exs.copy():
-                    self.logsearch_start = pos + 1
-                    if r.search(self.logs[pos]):
+            for line in lines:
+                self.logsearch_start = pos + 1
+                pos += 1
+                if subdaemon is not None and self.logs.subdaemon_of(line) != subdaemon:
+                    continue
+                if combined is not None and not combined.search(line):
+                    continue
+                for r in exs:
+                    if r.search(line):
                         logging.debug("Found '%s' in logs", r)
                         exs.remove(r)
                         break
                 if len(exs) == 0:
-                    return self.logs[pos]
-                pos += 1
+                    return line
+                combined = combine_regexs(exs)
 
-    def wait_for_log(self, regex, timeout=TIMEOUT):
+    def wait_for_log(self, regex, timeout=TIMEOUT, subdaemon=None):
         """Look for `regex` in the logs.
 
         Convenience wrapper for the common case of only seeking a single entry.
         """
-        return self.wait_for_logs([regex], timeout)
+        return self.wait_for_logs([regex], timeout, subdaemon)
 
 
 class SimpleBitcoinProxy:
     """Wrapper for BitcoinProxy to reconnect.
 
     Long wait times between calls to the Bitcoin RPC could result in
-    `bitcoind` closing the connection, so here we just create
-    throwaway connections. This is easier than to reach into the RPC
-    library to close, reopen and reauth upon failure.
+    `bitcoind` closing the connection, so calls go through a
+    `BitcoinRpcPool`, which keeps connections alive and reconnects
+    transparently if bitcoind hung up on an idle one.
     """
     def __init__(self, btc_conf_file, *args, **kwargs):
-        self.__btc_conf_file__ = btc_conf_file
+        self.__pool__ = BitcoinRpcPool(btc_conf_file)
 
     def __getattr__(self, name):
         if name.startswith('__') and name.endswith('__'):
@@ -240,10 +405,10 @@ class SimpleBitcoinProxy:
             raise AttributeError
 
         # Create a callable to do the actual call
-        proxy = BitcoinProxy(btc_conf_file=self.__btc_conf_file__)
+        pool = self.__pool__
 
         def f(*args):
-            return proxy._call(name, *args)
+            return pool.call(name, *args)
 
         # Make debuggers show <function bitcoin.rpc.name> rather than <function
         # bitcoin.rpc.<lambda>>
@@ -297,7 +462,7 @@ class BitcoinD(TailableProc):
 
 class LightningD(TailableProc):
     def __init__(self, lightning_dir, bitcoind, port=9735, random_hsm=False, node_id=0):
-        TailableProc.__init__(self, lightning_dir)
+        TailableProc.__init__(self, lightning_dir, subdaemon_regex=re.compile(r' (lightning_[a-z]+)'))
         self.executable = 'lightningd/lightningd'
         self.lightning_dir = lightning_dir
         self.port = port
@@ -381,6 +546,10 @@ class LightningNode(object):
         self.executor = executor
         self.may_fail = may_fail
         self.may_reconnect = may_reconnect
+        # Read-only connection to the database, see db_handle()
+        self.db = None
+        self.db_inode = None
+        self.db_lock = threading.Lock()
 
     def openchannel(self, remote_node, capacity, addrtype="p2sh-segwit", confirm=True, announce=True, connect=True):
         addr, wallettxid = self.fundwallet(10 * capacity, addrtype)
@@ -414,15 +583,46 @@ class LightningNode(object):
     def getactivechannels(self):
         return [c for c in self.rpc.listchannels()['channels'] if c['active']]
 
+    def db_handle(self):
+        """Read-only connection to the node's database, cached per node.
+
+        The connection is in autocommit mode, so each query is a single
+        read statement and only holds its shared lock while it runs.
+        Statements are prepared once and reused from the connection's
+        statement cache. Reopened if the database file was replaced.
+        """
+        path = os.path.join(self.daemon.lightning_dir, "lightningd.sqlite3")
+        inode = os.stat(path).st_ino
+        if self.db is None or self.db_inode != inode:
+            self.db_close()
+            self.db = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(path)),
+                                      uri=True, timeout=TIMEOUT, isolation_level=None,
+                                      check_same_thread=False, cached_statements=256)
+            self.db.row_factory = sqlite3.Row
+            self.db_inode = inode
+        return self.db
+
+    def db_close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
     def db_query(self, query, use_copy=True):
-        orig = os.path.join(self.daemon.lightning_dir, "lightningd.sqlite3")
+        """Run `query` against the node's database.
+
+        By default the query runs on the cached read-only handle from
+        db_handle(), without copying the database. With `use_copy=False`
+        the query runs on a writable connection to the live database and
+        is committed.
+        """
         if use_copy:
-            copy = os.path.join(self.daemon.lightning_dir, "lightningd-copy.sqlite3")
-            shutil.copyfile(orig, copy)
-            db = sqlite3.connect(copy)
-        else:
-            db = sqlite3.connect(orig)
+            with self.db_lock:
+                c = self.db_handle().execute(query)
+                rows = c.fetchall()
+                c.close()
+            return [dict(zip(row.keys(), row)) for row in rows]
 
+        db = sqlite3.connect(os.path.join(self.daemon.lightning_dir, "lightningd.sqlite3"))
         db.row_factory = sqlite3.Row
         c = db.cursor()
         c.execute(query)
@@ -473,6 +673,7 @@ class LightningNode(object):
 
         self.daemon.save_log()
         self.daemon.cleanup()
+        self.db_close()
 
         if rc != 0 and not self.may_fail:
             raise ValueError("Node did not exit cleanly, rc={}".format(rc))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark mininode messaging against a stub peer.
+
+Times what p2p tests spend most of their time on:
+- the version handshake of several connections,
+- sequential ping round trips with sync_with_ping,
+- sending blocks and syncing with a ping afterwards.
+
+The stub peer runs in its own process. It answers version with version
+and verack, ping with pong, and reads everything else. No elementsd is
+needed.
+
+By default test_framework/mininode.py is timed. --mininode times another
+version of it instead, e.g. the asyncore one from before the asyncio
+port, saved from qa/rpc-tests with:
+
+    git show <commit>:./test_framework/mininode.py > /tmp/mininode.py
+    bench/bench_mininode.py --mininode /tmp/mininode.py
+"""
+import argparse
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The package a --mininode file is loaded into
+import test_framework  # noqa: E402,F401
+
+MAGIC = b"\xfa\xbf\xb5\xda"  # regtest
+
+def load_mininode(path):
+    if path is None:
+        import test_framework.mininode as mininode
+        return mininode
+    spec = importlib.util.spec_from_file_location("test_framework.mininode", path)
+    mininode = importlib.util.module_from_spec(spec)
+    sys.modules["test_framework.mininode"] = mininode
+    spec.loader.exec_module(mininode)
+    return mininode
+
+def frame(command, payload):
+    checksum = hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    return MAGIC + command.ljust(12, b"\x00") + struct.pack("<I", len(payload)) + checksum + payload
+
+def stub_peer(sock, version_payload):
+    """Serve connections accepted on sock, one at a time per process."""
+    while True:
+        conn, _ = sock.accept()
+        if os.fork() == 0:
+            sock.close()
+            serve(conn, version_payload)
+            os._exit(0)
+        conn.close()
+
+def serve(conn, version_payload):
+    buf = b""
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            return
+        buf += data
+        while len(buf) >= 24:
+            length = struct.unpack("<I", buf[16:20])[0]
+            if len(buf) < 24 + length:
+                break
+            command = buf[4:16].rstrip(b"\x00")
+            payload = buf[24:24 + length]
+            buf = buf[24 + length:]
+            if command == b"version":
+                conn.sendall(frame(b"version", version_payload) + frame(b"verack", b""))
+            elif command == b"ping":
+                conn.sendall(frame(b"pong", payload))
+
+def make_block(mininode, num_tx):
+    block = mininode.CBlock()
+    for i in range(num_tx):
+        tx = mininode.CTransaction()
+        tx.vin.append(mininode.CTxIn(mininode.COutPoint(i, 0), b"\x51" * 100))
+        tx.vout.append(mininode.CTxOut())
+        block.vtx.append(tx)
+    return block
+
+def run(mininode, port, connections, pings, blocks, block_tx):
+    callbacks = []
+    conns = []
+    start = time.time()
+    for i in range(connections):
+        cb = mininode.SingleNodeConnCB()
+        conn = mininode.NodeConn('127.0.0.1', port, None, cb)
+        cb.add_connection(conn)
+        callbacks.append(cb)
+        conns.append(conn)
+    thread = mininode.NetworkThread()
+    thread.start()
+    for cb in callbacks:
+        cb.wait_for_verack()
+    handshake = time.time() - start
+
+    start = time.time()
+    for i in range(pings):
+        assert callbacks[i % connections].sync_with_ping()
+    ping = time.time() - start
+
+    block = mininode.msg_block(make_block(mininode, block_tx))
+    start = time.time()
+    for i in range(blocks):
+        callbacks[0].send_message(block)
+    assert callbacks[0].sync_with_ping()
+    send_blocks = time.time() - start
+
+    for conn in conns:
+        conn.disconnect_node()
+    thread.join()
+    return handshake, ping, send_blocks
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mininode', help="path of the mininode.py to time instead of test_framework's")
+    parser.add_argument('--connections', type=int, default=20)
+    parser.add_argument('--pings', type=int, default=200)
+    parser.add_argument('--blocks', type=int, default=200)
+    parser.add_argument('--block-tx', type=int, default=100)
+    args = parser.parse_args()
+
+    mininode = load_mininode(args.mininode)
+    version = mininode.msg_version()
+    version.nVersion = mininode.MY_VERSION
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(args.connections)
+    port = sock.getsockname()[1]
+    peer = multiprocessing.Process(target=stub_peer, args=(sock, version.serialize()))
+    peer.daemon = True
+    peer.start()
+    try:
+        handshake, ping, send_blocks = run(mininode, port, args.connections, args.pings, args.blocks, args.block_tx)
+    finally:
+        peer.terminate()
+
+    print("mininode: %s" % mininode.__file__)
+    print("  %-40s %10.2f ms" % ("handshake of %d connections" % args.connections, handshake * 1000))
+    print("  %-40s %10.2f ms" % ("%d sequential pings" % args.pings, ping * 1000))
+    print("  %-40s %10.2f ms" % ("%d blocks of %d txs, then a ping" % (args.blocks, args.block_tx), send_blocks * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -10,27 +10,85 @@
 from .mininode import *
 from io import BytesIO
 import dbm.dumb as dbmd
+import mmap
+import os
+
+# Each record in the block file is the block hash, the length of the
+# serialized block and the block itself. A record with length 0 erases the
+# block with that hash.
+RECORD_HEADER = struct.Struct("<32sI")
+# nVersion, hashPrevBlock, hashMerkleRoot, nTime, nHeight
+BLOCK_HEADER_PREFIX = struct.Struct("<i32s32sII")
 
 class BlockStore(object):
+    """Blocks kept in an append-only file, read back through mmap.
+
+    The in-memory index maps each block hash to the (offset, length,
+    height, prev) of its newest record, so locators and getdata replies
+    don't need to deserialize blocks. The index is rebuilt from the file
+    when an existing datadir is opened."""
+
     def __init__(self, datadir):
-        self.blockDB = dbmd.open(datadir + "/blocks", 'c')
+        self.blockFile = open(os.path.join(datadir, "blocks.dat"), "a+b")
+        self.blockMap = None
+        self.index = dict()
         self.currentBlock = 0
         self.headers_map = dict()
+        self._load_index()
+
+    def _load_index(self):
+        size = self.blockFile.seek(0, os.SEEK_END)
+        self._remap(size)
+        offset = 0
+        while offset + RECORD_HEADER.size <= size:
+            blockhash, length = RECORD_HEADER.unpack_from(self.blockMap, offset)
+            blockhash = uint256_from_str(blockhash)
+            offset += RECORD_HEADER.size
+            if length == 0:
+                self.index.pop(blockhash, None)
+                continue
+            self._index_block(blockhash, offset, length)
+            offset += length
+
+    def _index_block(self, blockhash, offset, length):
+        _, prev, _, _, height = BLOCK_HEADER_PREFIX.unpack_from(self.blockMap, offset)
+        self.index[blockhash] = (offset, length, height, uint256_from_str(prev))
+
+    def _remap(self, size):
+        """Map the first size bytes of the block file, if not mapped yet."""
+        if self.blockMap is not None and len(self.blockMap) >= size:
+            return
+        if self.blockMap is not None:
+            self.blockMap.close()
+            self.blockMap = None
+        if size > 0:
+            self.blockMap = mmap.mmap(self.blockFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _append(self, blockhash, data):
+        offset = self.blockFile.seek(0, os.SEEK_END) + RECORD_HEADER.size
+        self.blockFile.write(RECORD_HEADER.pack(ser_uint256(blockhash), len(data)))
+        self.blockFile.write(data)
+        self.blockFile.flush()
+        return offset
 
     def close(self):
-        self.blockDB.close()
+        if self.blockMap is not None:
+            self.blockMap.close()
+            self.blockMap = None
+        self.blockFile.close()
 
     def erase(self, blockhash):
-        del self.blockDB[repr(blockhash)]
+        del self.index[blockhash]
+        self._append(blockhash, b"")
 
     # lookup an entry and return the item as raw bytes
     def get(self, blockhash):
-        value = None
-        try:
-            value = self.blockDB[repr(blockhash)]
-        except KeyError:
+        entry = self.index.get(blockhash)
+        if entry is None:
             return None
-        return value
+        offset, length, _, _ = entry
+        self._remap(offset + length)
+        return self.blockMap[offset:offset + length]
 
     # lookup an entry and return it as a CBlock
     def get_block(self, blockhash):
@@ -49,9 +107,6 @@ class BlockStore(object):
         except KeyError:
             return None
 
-    # Note: this pulls full blocks out of the database just to retrieve
-    # the headers -- perhaps we could keep a separate data structure
-    # to avoid this overhead.
     def headers_for(self, locator, hash_stop, current_tip=None):
         if current_tip is None:
             current_tip = self.currentBlock
@@ -60,15 +115,16 @@ class BlockStore(object):
             return None
 
         response = msg_headers()
+        # Walk back from the tip, then put the headers in chain order
         headersList = [ current_block_header ]
         maxheaders = 2000
-        while (headersList[0].sha256 not in locator.vHave):
-            prevBlockHash = headersList[0].hashPrevBlock
-            prevBlockHeader = self.get_header(prevBlockHash)
+        while (headersList[-1].sha256 not in locator.vHave):
+            prevBlockHeader = self.get_header(headersList[-1].hashPrevBlock)
             if prevBlockHeader is not None:
-                headersList.insert(0, prevBlockHeader)
+                headersList.append(prevBlockHeader)
             else:
                 break
+        headersList.reverse()
         headersList = headersList[:maxheaders] # truncate if we have too many
         hashList = [x.sha256 for x in headersList]
         index = len(headersList)
@@ -80,9 +136,12 @@ class BlockStore(object):
     def add_block(self, block):
         block.calc_sha256()
         try:
-            self.blockDB[repr(block.sha256)] = bytes(block.serialize())
+            data = bytes(block.serialize())
         except TypeError as e:
             print("Unexpected error: ", sys.exc_info()[0], e.args)
+            return
+        offset = self._append(block.sha256, data)
+        self.index[block.sha256] = (offset, len(data), block.nHeight, block.hashPrevBlock)
         self.currentBlock = block.sha256
         self.headers_map[block.sha256] = CBlockHeader(block)
 
@@ -107,13 +166,15 @@ class BlockStore(object):
         r = []
         counter = 0
         step = 1
-        lastBlock = self.get_block(current_tip)
-        while lastBlock is not None:
-            r.append(lastBlock.hashPrevBlock)
+        entry = self.index.get(current_tip)
+        while entry is not None:
+            prev = entry[3]
+            r.append(prev)
             for i in range(step):
-                lastBlock = self.get_block(lastBlock.hashPrevBlock)
-                if lastBlock is None:
+                entry = self.index.get(prev)
+                if entry is None:
                     break
+                prev = entry[3]
             counter += 1
             if counter > 10:
                 step *= 2
@@ -156,6 +156,13 @@ class TestNode(NodeConnCB):
 #    on the final tx is None, then contents of entire mempool are compared
 #    across all connections.  (If outcome of final tx is specified as true
 #    or false, then only the last tx is tested against outcome.)
+#
+# Pipelining: with a TestManager window above 1, runs of objects whose
+# outcomes can be checked together are streamed instead of synced one by
+# one (see TestManager.can_pipeline). Each run of up to window objects is
+# inv'ed to every node at once, every node must request every object, and a
+# single getheaders/mempool + ping barrier then syncs the whole run before
+# the outcomes are checked in batch.
 
 class TestInstance(object):
     def __init__(self, objects=None, sync_every_block=True, sync_every_tx=False):
@@ -165,13 +172,17 @@ class TestInstance(object):
 
 class TestManager(object):
 
-    def __init__(self, testgen, datadir):
+    def __init__(self, testgen, datadir, window=None):
         self.test_generator = testgen
         self.connections    = []
         self.test_nodes     = []
         self.block_store    = BlockStore(datadir)
         self.tx_store       = TxStore(datadir)
         self.ping_counter   = 1
+        # Number of objects streamed per sync, 1 disables pipelining
+        if window is None:
+            window = getattr(getattr(testgen, "options", None), "pipeline_window", 1)
+        self.window = min(max(window, 1), MAX_INV_SZ)
 
     def add_all_connections(self, nodes):
         for i in range(len(nodes)):
@@ -203,13 +214,14 @@ class TestManager(object):
         return wait_until(received_pongs)
 
     # sync_blocks: Wait for all connections to request the blockhash given
-    # then send get_headers to find out the tip of each node, and synchronize
-    # the response by using a ping (and waiting for pong with same nonce).
+    # (or all of the blockhashes, if a list) then send get_headers to find out
+    # the tip of each node, and synchronize the response by using a ping (and
+    # waiting for pong with same nonce).
     def sync_blocks(self, blockhash, num_blocks):
+        blockhashes = blockhash if isinstance(blockhash, list) else [blockhash]
         def blocks_requested():
             return all(
-                blockhash in node.block_request_map and node.block_request_map[blockhash]
-                for node in self.test_nodes
+                node.block_request_map.get(h) for node in self.test_nodes for h in blockhashes
             )
 
         # --> error if not requested
@@ -227,11 +239,11 @@ class TestManager(object):
 
     # Analogous to sync_block (see above)
     def sync_transaction(self, txhash, num_events):
+        txhashes = txhash if isinstance(txhash, list) else [txhash]
         # Wait for nodes to request transaction (50ms sleep * 20 tries * num_events)
         def transaction_requested():
             return all(
-                txhash in node.tx_request_map and node.tx_request_map[txhash]
-                for node in self.test_nodes
+                node.tx_request_map.get(h) for node in self.test_nodes for h in txhashes
             )
 
         # --> error if not requested
@@ -301,6 +313,74 @@ class TestManager(object):
                     return False
             return True
 
+    # Add a block to the shared block_store and set it as current block.
+    # If there was an open getdata request for the block previously, and we
+    # didn't have an entry in the block_store, then immediately deliver,
+    # because the node wouldn't send another getdata request while the
+    # earlier one is outstanding.
+    def add_block(self, block):
+        first_block_with_hash = True
+        if self.block_store.get(block.sha256) is not None:
+            first_block_with_hash = False
+        with mininode_lock:
+            self.block_store.add_block(block)
+            for c in self.connections:
+                if first_block_with_hash and block.sha256 in c.cb.block_request_map and c.cb.block_request_map[block.sha256] == True:
+                    # There was a previous request for this block hash
+                    # Most likely, we delivered a header for this block
+                    # but never had the block to respond to the getdata
+                    c.send_message(msg_block(block))
+                else:
+                    c.cb.block_request_map[block.sha256] = False
+
+    def add_transaction(self, tx):
+        with mininode_lock:
+            self.tx_store.add_transaction(tx)
+            for c in self.connections:
+                c.cb.tx_request_map[tx.sha256] = False
+
+    # Whether test_obj can join the run of pending objects. Blocks expected
+    # to be accepted can, as long as each extends the previous one: the last
+    # block becoming the tip implies all of them were accepted. Transactions
+    # with a definite outcome can, since each outcome can still be checked
+    # once the whole run has been synced.
+    def can_pipeline(self, test_instance, test_obj, pending):
+        if self.window == 1:
+            return False
+        obj, outcome = test_obj[0], test_obj[1]
+        if isinstance(obj, CBlock):
+            if not test_instance.sync_every_block or outcome is not True:
+                return False
+            if len(test_obj) >= 3 and test_obj[2] not in (None, obj.sha256):
+                return False
+            return not pending or (isinstance(pending[-1][0], CBlock) and obj.hashPrevBlock == pending[-1][0].sha256)
+        if isinstance(obj, CTransaction):
+            if not test_instance.sync_every_tx or outcome is None:
+                return False
+            return not pending or isinstance(pending[-1][0], CTransaction)
+        return False
+
+    # Stream a run of pending objects to every node and sync them together.
+    def sync_pending(self, pending, test_number):
+        objs = [test_obj[0] for test_obj in pending]
+        if isinstance(objs[0], CBlock):
+            for block in objs:
+                self.add_block(block)
+            invs = [CInv(2, block.sha256) for block in objs]
+            [ c.send_message(msg_inv(invs)) for c in self.connections ]
+            self.sync_blocks([block.sha256 for block in objs], len(objs))
+            if (not self.check_results(objs[-1].sha256, True)):
+                raise AssertionError("Test failed at test %d" % test_number)
+        else:
+            for tx in objs:
+                self.add_transaction(tx)
+            invs = [CInv(1, tx.sha256) for tx in objs]
+            [ c.send_message(msg_inv(invs)) for c in self.connections ]
+            self.sync_transaction([tx.sha256 for tx in objs], len(objs))
+            for tx, test_obj in zip(objs, pending):
+                if (not self.check_mempool(tx.sha256, test_obj[1])):
+                    raise AssertionError("Test failed at test %d" % test_number)
+
     def run(self):
         # Wait until verack is received
         self.wait_for_verack()
@@ -313,8 +393,18 @@ class TestManager(object):
             [ block, block_outcome, tip ] = [ None, None, None ]
             [ tx, tx_outcome ] = [ None, None ]
             invqueue = []
+            pending = []
 
             for test_obj in test_instance.blocks_and_transactions:
+                if self.can_pipeline(test_instance, test_obj, pending):
+                    pending.append(test_obj)
+                    if len(pending) == self.window:
+                        self.sync_pending(pending, test_number)
+                        pending = []
+                    continue
+                if pending:
+                    self.sync_pending(pending, test_number)
+                    pending = []
                 b_or_t = test_obj[0]
                 outcome = test_obj[1]
                 # Determine if we're dealing with a block or tx
@@ -329,24 +419,7 @@ class TestManager(object):
                         tip = test_obj[2]
 
                     # Add to shared block_store, set as current block
-                    # If there was an open getdata request for the block
-                    # previously, and we didn't have an entry in the
-                    # block_store, then immediately deliver, because the
-                    # node wouldn't send another getdata request while
-                    # the earlier one is outstanding.
-                    first_block_with_hash = True
-                    if self.block_store.get(block.sha256) is not None:
-                        first_block_with_hash = False
-                    with mininode_lock:
-                        self.block_store.add_block(block)
-                        for c in self.connections:
-                            if first_block_with_hash and block.sha256 in c.cb.block_request_map and c.cb.block_request_map[block.sha256] == True:
-                                # There was a previous request for this block hash
-                                # Most likely, we delivered a header for this block
-                                # but never had the block to respond to the getdata
-                                c.send_message(msg_block(block))
-                            else:
-                                c.cb.block_request_map[block.sha256] = False
+                    self.add_block(block)
                     # Either send inv's to each node and sync, or add
                     # to invqueue for later inv'ing.
                     if (test_instance.sync_every_block):
@@ -374,10 +447,7 @@ class TestManager(object):
                     tx = b_or_t
                     tx_outcome = outcome
                     # Add to shared tx store and clear map entry
-                    with mininode_lock:
-                        self.tx_store.add_transaction(tx)
-                        for c in self.connections:
-                            c.cb.tx_request_map[tx.sha256] = False
+                    self.add_transaction(tx)
                     # Again, either inv to all nodes or save for later
                     if (test_instance.sync_every_tx):
                         [ c.cb.send_inv(tx) for c in self.connections ]
@@ -391,6 +461,9 @@ class TestManager(object):
                     [ c.send_message(msg_inv(invqueue)) for c in self.connections ]
                     invqueue = []
 
+            if pending:
+                self.sync_pending(pending, test_number)
+
             # Do final sync if we weren't syncing on every block or every tx.
             if (not test_instance.sync_every_block and block is not None):
                 if len(invqueue) > 0:
@@ -22,9 +22,9 @@
 # ser_*, deser_*: functions that handle serialization/deserialization
 
 
+import asyncio
 import struct
 import socket
-import asyncore
 import time
 import sys
 import random
@@ -32,7 +32,7 @@ from .util import hex_str_to_bytes, bytes_to_hex_str, BITCOIN_ASSET_OUT
 from io import BytesIO
 from codecs import encode
 import hashlib
-from threading import RLock
+from threading import Condition, RLock
 from threading import Thread
 import logging
 import copy
@@ -53,9 +53,9 @@ NODE_GETUTXO = (1 << 1)
 NODE_BLOOM = (1 << 2)
 NODE_WITNESS = (1 << 3)
 
-# Keep our own socket map for asyncore, so that we can track disconnects
-# ourselves (to workaround an issue with closing an asyncore socket when
-# using select)
+# The NodeConns that are connecting or connected. The NetworkThread connects
+# the ones created before it started, and its event loop stops once they
+# have all been closed.
 mininode_socket_map = dict()
 
 # One lock for synchronizing all data access between the networking thread (see
@@ -64,7 +64,10 @@ mininode_socket_map = dict()
 # and whenever adding anything to the send buffer (in send_message()).  This
 # lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the NodeConnCB or NodeConn.
-mininode_lock = RLock()
+# It is a Condition, notified whenever a message has been delivered or a
+# connection opened or closed, so wait_until() wakes up right away instead of
+# polling.
+mininode_lock = Condition(RLock())
 
 # Serialization/deserialization tools
 def sha256(s):
@@ -1536,18 +1539,19 @@ class msg_reject(object):
 
 # Helper function
 def wait_until(predicate, *, attempts=float('inf'), timeout=float('inf')):
-    attempt = 0
-    elapsed = 0
+    # Each attempt used to be a 0.05s sleep; keep that budget for callers
+    # that count attempts. Predicates that depend on more than the messages
+    # delivered (e.g. RPC state) are still re-checked every 0.05s.
+    deadline = time.time() + min(timeout, attempts * 0.05)
 
-    while attempt < attempts and elapsed < timeout:
-        with mininode_lock:
+    with mininode_lock:
+        while True:
             if predicate():
                 return True
-        attempt += 1
-        elapsed += 0.05
-        time.sleep(0.05)
-
-    return False
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            mininode_lock.wait(min(remaining, 0.05))
 
 class msg_feefilter(object):
     command = b"feefilter"
@@ -1665,16 +1669,14 @@ class NodeConnCB(object):
         with mininode_lock:
             return self.deliver_sleep_time
 
-    # Spin until verack message is received from the node.
+    # Wait until verack message is received from the node.
     # Tests may want to use this as a signal that the test can begin.
     # This can be called from the testing thread, so it needs to acquire the
     # global lock.
     def wait_for_verack(self):
-        while True:
-            with mininode_lock:
-                if self.verack_received:
-                    return
-            time.sleep(0.05)
+        with mininode_lock:
+            while not self.verack_received:
+                mininode_lock.wait()
 
     def deliver(self, conn, message):
         deliver_sleep = self.get_deliver_sleep_time()
@@ -1686,6 +1688,8 @@ class NodeConnCB(object):
             except:
                 print("ERROR delivering %s (%s)" % (repr(message),
                                                     sys.exc_info()[0]))
+            finally:
+                mininode_lock.notify_all()
 
     def on_version(self, conn, message):
         if message.nVersion >= 209:
@@ -1764,7 +1768,7 @@ class SingleNodeConnCB(NodeConnCB):
 
 # The actual NodeConn class
 # This class provides an interface for a p2p connection to a specified node
-class NodeConn(asyncore.dispatcher):
+class NodeConn(asyncio.Protocol):
     messagemap = {
         b"version": msg_version,
         b"verack": msg_verack,
@@ -1796,13 +1800,15 @@ class NodeConn(asyncore.dispatcher):
     }
 
     def __init__(self, dstaddr, dstport, rpc, callback, net="regtest", services=NODE_NETWORK, send_version=True):
-        asyncore.dispatcher.__init__(self, map=mininode_socket_map)
         self.log = logging.getLogger("NodeConn(%s:%d)" % (dstaddr, dstport))
         self.dstaddr = dstaddr
         self.dstport = dstport
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        # The event loop of the NetworkThread handling this connection
+        self.loop = None
+        self.transport = None
+        # Messages sent before the connection is made, see send_message()
         self.sendbuf = b""
-        self.recvbuf = b""
+        self.recvbuf = bytearray()
         self.ver_send = 209
         self.ver_recv = 209
         self.last_sent = 0
@@ -1811,6 +1817,7 @@ class NodeConn(asyncore.dispatcher):
         self.cb = callback
         self.disconnect = False
         self.nServices = 0
+        self.rpc = rpc
 
         if send_version:
             # stuff version msg into sendbuf
@@ -1825,99 +1832,108 @@ class NodeConn(asyncore.dispatcher):
         print('MiniNode: Connecting to Bitcoin Node IP # ' + dstaddr + ':' \
             + str(dstport))
 
-        try:
-            self.connect((dstaddr, dstport))
-        except:
-            self.handle_close()
-        self.rpc = rpc
+        # Connect right away if a network thread is already running,
+        # otherwise the next one to start connects us.
+        with mininode_lock:
+            mininode_socket_map[id(self)] = self
+            self.loop = NetworkThread.network_event_loop
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.start_connect)
 
     def show_debug_msg(self, msg):
         self.log.debug(msg)
 
-    def handle_connect(self):
-        if self.state != "connected":
+    def start_connect(self):
+        """Start connecting, from the network thread."""
+        if self.disconnect:
+            self.handle_close()
+            return
+        self.loop.create_task(self._connect())
+
+    async def _connect(self):
+        try:
+            await self.loop.create_connection(lambda: self, host=self.dstaddr, port=self.dstport)
+        except OSError:
+            self.handle_close()
+
+    def connection_made(self, transport):
+        """asyncio callback when the connection is opened."""
+        with mininode_lock:
+            self.transport = transport
+            if self.disconnect:
+                transport.close()
+                return
             self.show_debug_msg("MiniNode: Connected & Listening: \n")
             self.state = "connected"
+            if self.sendbuf:
+                transport.write(self.sendbuf)
+                self.sendbuf = b""
             self.cb.on_open(self)
+            mininode_lock.notify_all()
+
+    def connection_lost(self, exc):
+        """asyncio callback when the connection is closed."""
+        self.handle_close()
 
     def handle_close(self):
         self.show_debug_msg("MiniNode: Closing Connection to %s:%d... "
                             % (self.dstaddr, self.dstport))
-        self.state = "closed"
-        self.recvbuf = b""
-        self.sendbuf = b""
-        try:
-            self.close()
-        except:
-            pass
-        self.cb.on_close(self)
-
-    def handle_read(self):
-        try:
-            t = self.recv(8192)
-            if len(t) > 0:
-                self.recvbuf += t
-                self.got_data()
-        except:
-            pass
-
-    def readable(self):
-        return True
-
-    def writable(self):
-        with mininode_lock:
-            pre_connection = self.state == "connecting"
-            length = len(self.sendbuf)
-        return (length > 0 or pre_connection)
-
-    def handle_write(self):
         with mininode_lock:
-            # asyncore does not expose socket connection, only the first read/write
-            # event, thus we must check connection manually here to know when we
-            # actually connect
-            if self.state == "connecting":
-                self.handle_connect()
-            if not self.writable():
+            if self.state == "closed":
                 return
-
-            try:
-                sent = self.send(self.sendbuf)
-            except:
-                self.handle_close()
-                return
-            self.sendbuf = self.sendbuf[sent:]
+            self.state = "closed"
+            self.recvbuf = bytearray()
+            self.sendbuf = b""
+            if self.transport is not None:
+                self.transport.abort()
+                self.transport = None
+            mininode_socket_map.pop(id(self), None)
+            self.cb.on_close(self)
+            mininode_lock.notify_all()
+            if self.loop is not None and not any(conn.loop is self.loop for conn in mininode_socket_map.values()):
+                self.loop.stop()
+
+    def data_received(self, t):
+        """asyncio callback when data is read from the socket."""
+        if len(t) > 0:
+            self.recvbuf += t
+            self.got_data()
 
     def got_data(self):
+        # Messages are parsed at increasing offsets into recvbuf, and the
+        # consumed bytes are dropped once at the end.
+        pos = 0
+        buf = self.recvbuf
         try:
             while True:
-                if len(self.recvbuf) < 4:
+                if len(buf) - pos < 4:
                     return
-                if self.recvbuf[:4] != self.MAGIC_BYTES[self.network]:
-                    raise ValueError("got garbage %s" % repr(self.recvbuf))
+                if buf[pos:pos+4] != self.MAGIC_BYTES[self.network]:
+                    raise ValueError("got garbage %s" % repr(buf[pos:]))
                 if self.ver_recv < 209:
-                    if len(self.recvbuf) < 4 + 12 + 4:
+                    if len(buf) - pos < 4 + 12 + 4:
                         return
-                    command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
+                    command = bytes(buf[pos+4:pos+4+12]).split(b"\x00", 1)[0]
+                    msglen = struct.unpack_from("<i", buf, pos+4+12)[0]
                     checksum = None
-                    if len(self.recvbuf) < 4 + 12 + 4 + msglen:
+                    if len(buf) - pos < 4 + 12 + 4 + msglen:
                         return
-                    msg = self.recvbuf[4+12+4:4+12+4+msglen]
-                    self.recvbuf = self.recvbuf[4+12+4+msglen:]
+                    msg = bytes(buf[pos+4+12+4:pos+4+12+4+msglen])
+                    pos += 4+12+4+msglen
                 else:
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4:
+                    if len(buf) - pos < 4 + 12 + 4 + 4:
                         return
-                    command = self.recvbuf[4:4+12].split(b"\x00", 1)[0]
-                    msglen = struct.unpack("<i", self.recvbuf[4+12:4+12+4])[0]
-                    checksum = self.recvbuf[4+12+4:4+12+4+4]
-                    if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
+                    command = bytes(buf[pos+4:pos+4+12]).split(b"\x00", 1)[0]
+                    msglen = struct.unpack_from("<i", buf, pos+4+12)[0]
+                    checksum = buf[pos+4+12+4:pos+4+12+4+4]
+                    if len(buf) - pos < 4 + 12 + 4 + 4 + msglen:
                         return
-                    msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                    msg = bytes(buf[pos+4+12+4+4:pos+4+12+4+4+msglen])
                     th = sha256(msg)
                     h = sha256(th)
                     if checksum != h[:4]:
-                        raise ValueError("got bad checksum " + repr(self.recvbuf))
-                    self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
+                        raise ValueError("got bad checksum " + repr(buf[pos:]))
+                    pos += 4+12+4+4+msglen
                 if command in self.messagemap:
                     f = BytesIO(msg)
                     t = self.messagemap[command]()
@@ -1930,6 +1946,8 @@ class NodeConn(asyncore.dispatcher):
             print('got_data:', repr(e))
             # import  traceback
             # traceback.print_tb(sys.exc_info()[2])
+        finally:
+            del buf[:pos]
 
     def send_message(self, message, pushbuf=False):
         if self.state != "connected" and not pushbuf:
@@ -1947,9 +1965,16 @@ class NodeConn(asyncore.dispatcher):
             tmsg += h[:4]
         tmsg += data
         with mininode_lock:
-            self.sendbuf += tmsg
+            if self.state == "connected":
+                self.loop.call_soon_threadsafe(self._write, tmsg)
+            elif self.state == "connecting":
+                self.sendbuf += tmsg
             self.last_sent = time.time()
 
+    def _write(self, data):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
     def got_message(self, message):
         if message.command == b"version":
             if message.nVersion <= BIP0031_VERSION:
@@ -1960,21 +1985,35 @@ class NodeConn(asyncore.dispatcher):
         self.cb.deliver(self, message)
 
     def disconnect_node(self):
-        self.disconnect = True
+        with mininode_lock:
+            self.disconnect = True
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.handle_close)
 
 
 class NetworkThread(Thread):
+    """Runs an asyncio event loop for the NodeConns, until all are closed."""
+    network_event_loop = None
+
     def run(self):
-        while mininode_socket_map:
-            # We check for whether to disconnect outside of the asyncore
-            # loop to workaround the behavior of asyncore when using
-            # select
-            disconnected = []
-            for fd, obj in mininode_socket_map.items():
-                if obj.disconnect:
-                    disconnected.append(obj)
-            [ obj.handle_close() for obj in disconnected ]
-            asyncore.loop(0.1, use_poll=True, map=mininode_socket_map, count=1)
+        loop = asyncio.new_event_loop()
+        with mininode_lock:
+            conns = [conn for conn in mininode_socket_map.values() if conn.loop is None]
+            for conn in conns:
+                conn.loop = loop
+                loop.call_soon(conn.start_connect)
+            NetworkThread.network_event_loop = loop
+        if conns:
+            loop.run_forever()
+        with mininode_lock:
+            if NetworkThread.network_event_loop is loop:
+                NetworkThread.network_event_loop = None
+            # Leave connections created while the loop was stopping to the
+            # next NetworkThread.
+            for conn in mininode_socket_map.values():
+                if conn.loop is loop:
+                    conn.loop = None
+        loop.close()
 
 
 # An exception we can raise if we detect a potential disconnect
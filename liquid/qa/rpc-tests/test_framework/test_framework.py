@@ -210,6 +210,8 @@ class ComparisonTestFramework(BitcoinTestFramework):
         parser.add_option("--refbinary", dest="refbinary",
                           default=os.getenv("LIQUIDD", "liquidd"),
                           help="bitcoind binary to use for reference nodes (if any)")
+        parser.add_option("--pipelinewindow", dest="pipeline_window", default=1, type='int',
+                          help="stream up to this many blocks or transactions per sync in comptool tests (default: %default, no pipelining)")
 
     def setup_network(self):
         self.nodes = start_nodes(